@@ -0,0 +1,324 @@
+import os
+import time
+import logging
+import datetime
+import threading
+import numpy as np
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Product, Size, AlertState
+
+# Configure logging
+logger = logging.getLogger("snidan_alert_rules")
+
+# Thresholds are reloaded at least this often, on top of explicit invalidation (can be overridden in .env)
+RELOAD_INTERVAL = float(os.getenv("ALERT_RULES_RELOAD_SECONDS", "300"))
+
+# Noise suppression (can be overridden in .env)
+# Change/drop alerts within this many seconds of the previous alert are dropped
+COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "300"))
+# A below/above rule re-arms once the price is this far back on the other side of its threshold
+HYSTERESIS_PERCENT = float(os.getenv("ALERT_HYSTERESIS_PERCENT", "2"))
+# A repeat alert needs a move of at least this many yen and this percentage since the last alert
+MIN_DELTA_YEN = float(os.getenv("ALERT_MIN_DELTA_YEN", "300"))
+MIN_DELTA_PERCENT = float(os.getenv("ALERT_MIN_DELTA_PERCENT", "1"))
+
+# Alert types in order of precedence: a change that matches several rules is reported once, as the first
+ALERT_TYPES = ("below", "above", "drop", "change")
+
+
+class ThresholdTable:
+    """Alert thresholds of every active size, as arrays sorted by size id (NaN means no threshold)"""
+
+    def __init__(self, size_ids, below, above, drop_percent, any_change):
+        self.size_ids = size_ids
+        self.below = below
+        self.above = above
+        self.drop_percent = drop_percent
+        self.any_change = any_change
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.size_ids)
+
+    @classmethod
+    def load(cls, db):
+        """Read the thresholds of all active products' sizes in one query"""
+        rows = (
+            db.session.query(Size.id, Size.notify_below, Size.notify_above, Size.notify_drop_percent, Size.notify_on_any_change)
+            .join(Product, Product.id == Size.product_id)
+            .filter(Product.is_active == True)
+            .order_by(Size.id)
+            .all()
+        )
+        if not rows:
+            empty = np.empty(0)
+            return cls(np.empty(0, dtype=np.int64), empty, empty, empty, np.empty(0, dtype=bool))
+        size_ids, below, above, drop_percent, any_change = zip(*rows)
+        return cls(
+            np.array(size_ids, dtype=np.int64),
+            _float_array(below),
+            _float_array(above),
+            _float_array(drop_percent),
+            np.array([bool(value) for value in any_change], dtype=bool)
+        )
+
+
+def _float_array(values):
+    """Convert optional numbers to a float array with NaN for missing values"""
+    return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+
+class ThresholdEngine:
+    """Evaluate the alert rules of a whole batch of price changes in one vectorized pass"""
+
+    def __init__(self, db, reload_interval=None):
+        self.db = db
+        self.reload_interval = reload_interval if reload_interval is not None else RELOAD_INTERVAL
+        self._table = None
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Reload the thresholds before the next evaluation"""
+        self._dirty = True
+
+    def _current_table(self):
+        with self._lock:
+            if (self._dirty or self._table is None
+                    or time.monotonic() - self._table.loaded_at >= self.reload_interval):
+                self._dirty = False
+                self._table = ThresholdTable.load(self.db)
+                logger.info(f"Loaded alert thresholds for {len(self._table)} sizes")
+            return self._table
+
+    def evaluate(self, changes, _reloaded=False):
+        """Return [(PriceChange, alert_type)] for the changes that trigger an alert"""
+        if not changes:
+            return []
+
+        table = self._current_table()
+        count = len(changes)
+        size_ids = np.fromiter((change.size_id for change in changes), dtype=np.int64, count=count)
+
+        positions = np.searchsorted(table.size_ids, size_ids)
+        positions = np.minimum(positions, max(len(table) - 1, 0))
+        known = table.size_ids[positions] == size_ids if len(table) else np.zeros(count, dtype=bool)
+        if not known.all() and not _reloaded:
+            # Sizes added since the last load: fetch the new thresholds once
+            self.invalidate()
+            return self.evaluate(changes, _reloaded=True)
+
+        old = np.fromiter((change.old_price or 0 for change in changes), dtype=np.float64, count=count)
+        new = np.fromiter((change.new_price for change in changes), dtype=np.float64, count=count)
+
+        if len(table):
+            below = np.where(known, table.below[positions], np.nan)
+            above = np.where(known, table.above[positions], np.nan)
+            drop_percent = np.where(known, table.drop_percent[positions], np.nan)
+            any_change = known & table.any_change[positions]
+        else:
+            below, above, drop_percent = (np.full(count, np.nan) for _ in range(3))
+            any_change = np.zeros(count, dtype=bool)
+
+        if not known.all():
+            # Sizes of inactive products fall back to the thresholds captured with the change
+            for index in np.flatnonzero(~known):
+                change = changes[index]
+                below[index] = np.nan if change.notify_below is None else change.notify_below
+                above[index] = np.nan if change.notify_above is None else change.notify_above
+                drop_percent[index] = np.nan if change.notify_drop_percent is None else change.notify_drop_percent
+                any_change[index] = bool(change.notify_on_any_change)
+
+        # Comparisons with NaN are False, so sizes without a threshold never match it
+        with np.errstate(invalid="ignore"):
+            triggered = np.select(
+                [
+                    new <= below,
+                    new >= above,
+                    (old > 0) & ((old - new) * 100 >= drop_percent * old),
+                    any_change
+                ],
+                np.arange(len(ALERT_TYPES)),
+                default=-1
+            )
+
+        return [(changes[index], ALERT_TYPES[triggered[index]]) for index in np.flatnonzero(triggered >= 0)]
+
+
+class SizeAlertState:
+    """In-memory copy of an alert_state row"""
+
+    __slots__ = ("size_id", "last_alert_type", "last_alerted_price", "last_alerted_at", "below_armed", "above_armed")
+
+    def __init__(self, size_id, last_alert_type=None, last_alerted_price=None, last_alerted_at=None, below_armed=True, above_armed=True):
+        self.size_id = size_id
+        self.last_alert_type = last_alert_type
+        self.last_alerted_price = last_alerted_price
+        self.last_alerted_at = last_alerted_at
+        self.below_armed = below_armed
+        self.above_armed = above_armed
+
+    def to_row(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class AlertGate:
+    """Suppress alerts that are repeats, flicker around a threshold or come too soon after the last one.
+
+    The per-size state is kept in memory and written through to the
+    alert_state table, so it survives restarts.
+    """
+
+    def __init__(self, db, cooldown=None, hysteresis_percent=None, min_delta_yen=None, min_delta_percent=None):
+        self.db = db
+        self.cooldown = datetime.timedelta(seconds=cooldown if cooldown is not None else COOLDOWN_SECONDS)
+        self.hysteresis = (hysteresis_percent if hysteresis_percent is not None else HYSTERESIS_PERCENT) / 100
+        self.min_delta_yen = min_delta_yen if min_delta_yen is not None else MIN_DELTA_YEN
+        self.min_delta_percent = min_delta_percent if min_delta_percent is not None else MIN_DELTA_PERCENT
+        self.allowed = 0
+        self.suppressed = 0
+        self._states = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._states is None:
+            self._states = {
+                row.size_id: SizeAlertState(row.size_id, row.last_alert_type, row.last_alerted_price,
+                                            row.last_alerted_at, row.below_armed, row.above_armed)
+                for row in AlertState.query.all()
+            }
+            logger.info(f"Loaded alert state for {len(self._states)} sizes")
+        return self._states
+
+    def _rearm(self, state, change):
+        """Re-arm threshold rules once the price has moved back past the hysteresis band; returns True when changed"""
+        changed = False
+        if not state.below_armed and (change.notify_below is None or change.new_price >= change.notify_below * (1 + self.hysteresis)):
+            state.below_armed = True
+            changed = True
+        if not state.above_armed and (change.notify_above is None or change.new_price <= change.notify_above * (1 - self.hysteresis)):
+            state.above_armed = True
+            changed = True
+        return changed
+
+    def _is_noise(self, state, change, alert_type, now):
+        """Return the reason an alert should be suppressed, or None to send it"""
+        if alert_type == "below" and not state.below_armed:
+            return "below threshold still crossed"
+        if alert_type == "above" and not state.above_armed:
+            return "above threshold still crossed"
+        if alert_type in ("below", "above"):
+            # An armed threshold crossing is sent once, however recent the last alert was;
+            # dropping it here would lose it for good while the price stays put
+            return None
+        if state.last_alerted_at and now - state.last_alerted_at < self.cooldown:
+            return "cooldown"
+        if state.last_alerted_price:
+            delta = abs(change.new_price - state.last_alerted_price)
+            if delta < self.min_delta_yen or delta * 100 < self.min_delta_percent * state.last_alerted_price:
+                return "move too small"
+        return None
+
+    def filter(self, changes, alerts, now=None):
+        """Return the alerts that should be sent and persist the updated per-size state"""
+        now = now or datetime.datetime.now()
+        alert_types = {change.size_id: alert_type for change, alert_type in alerts}
+        allowed = []
+        dirty = {}
+
+        with self._lock:
+            states = self._load()
+            for change in changes:
+                state = states.get(change.size_id)
+                alert_type = alert_types.get(change.size_id)
+                if state is None and alert_type is None:
+                    continue
+
+                if state is not None and self._rearm(state, change):
+                    dirty[state.size_id] = state
+                if alert_type is None:
+                    continue
+
+                if state is not None:
+                    reason = self._is_noise(state, change, alert_type, now)
+                    if reason:
+                        self.suppressed += 1
+                        logger.debug(f"Suppressed {alert_type} alert for size {change.size_id}: {reason}")
+                        continue
+                else:
+                    state = states[change.size_id] = SizeAlertState(change.size_id)
+
+                state.last_alert_type = alert_type
+                state.last_alerted_price = change.new_price
+                state.last_alerted_at = now
+                if alert_type == "below":
+                    state.below_armed = False
+                elif alert_type == "above":
+                    state.above_armed = False
+                dirty[state.size_id] = state
+                allowed.append((change, alert_type))
+                self.allowed += 1
+
+        if dirty:
+            self._persist(list(dirty.values()))
+        return allowed
+
+    def _persist(self, states):
+        """Upsert the changed states in one transaction"""
+        rows = [state.to_row() for state in states]
+        try:
+            # Chunked to stay below SQLite's limit on bound parameters
+            for start in range(0, len(rows), 1000):
+                statement = sqlite_insert(AlertState.__table__).values(rows[start:start + 1000])
+                statement = statement.on_conflict_do_update(
+                    index_elements=["size_id"],
+                    set_={column: statement.excluded[column] for column in rows[0] if column != "size_id"}
+                )
+                self.db.session.execute(statement)
+            self.db.session.commit()
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"Error saving alert state for {len(rows)} sizes: {str(e)}")
+
+    def clear(self, size_ids):
+        """Forget the alert state of sizes, e.g. after their thresholds were edited (the caller commits)"""
+        size_ids = list(size_ids)
+        if not size_ids:
+            return
+        AlertState.query.filter(AlertState.size_id.in_(size_ids)).delete(synchronize_session=False)
+        with self._lock:
+            if self._states is not None:
+                for size_id in size_ids:
+                    self._states.pop(size_id, None)
+
+    def stats(self):
+        return {'allowed': self.allowed, 'suppressed': self.suppressed}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_gate = None
+
+
+def get_threshold_engine(db):
+    """Return the process-wide threshold engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ThresholdEngine(db)
+        return _engine
+
+
+def get_alert_gate(db):
+    """Return the process-wide alert gate"""
+    global _gate
+    with _engine_lock:
+        if _gate is None:
+            _gate = AlertGate(db)
+        return _gate
+
+
+def invalidate_thresholds():
+    """Make the engine reload thresholds after sizes or products have been edited"""
+    if _engine is not None:
+        _engine.invalidate()
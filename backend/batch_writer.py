@@ -0,0 +1,173 @@
+import os
+import time
+import logging
+import datetime
+from collections import namedtuple
+from sqlalchemy import update, bindparam
+from models import Product, Size, PriceHistory
+from scraper import invalidate_price_cache, PRICES_UNCHANGED
+import price_rollups
+import price_intervals
+from product_cache import get_product_cache
+import http_cache
+
+# Configure logging
+logger = logging.getLogger("snidan_writer")
+
+# Write-behind settings (can be overridden in .env)
+DEFAULT_FLUSH_EVERY = int(os.getenv("MONITOR_FLUSH_EVERY", "50"))
+DEFAULT_FLUSH_INTERVAL = float(os.getenv("MONITOR_FLUSH_INTERVAL", "5"))
+
+# A committed price change, detached from the session so it can be used after the flush
+PriceChange = namedtuple("PriceChange", [
+    "product_id", "product_name", "product_url",
+    "size_id", "size", "old_price", "new_price",
+    "notify_below", "notify_above", "notify_drop_percent", "notify_on_any_change",
+    "timestamp"
+])
+
+
+class PriceWriteBuffer:
+    """Collect poll results and write them in one transaction per flush window"""
+
+    def __init__(self, db, flush_every=None, flush_interval=None):
+        self.db = db
+        self.flush_every = max(1, flush_every or DEFAULT_FLUSH_EVERY)
+        self.flush_interval = flush_interval or DEFAULT_FLUSH_INTERVAL
+        self.commits = 0
+        self.products_written = 0
+        self._observations = {}
+        self._window_started = None
+
+    def __len__(self):
+        return len(self._observations)
+
+    def add(self, target, prices, checked_at=None):
+        """Buffer the prices fetched for a product (or PRICES_UNCHANGED)"""
+        if not self._observations:
+            self._window_started = time.monotonic()
+        self._observations[target.id] = (target, prices, checked_at or datetime.datetime.now())
+
+    def should_flush(self):
+        """Return True once the buffer holds flush_every products or flush_interval has passed"""
+        if not self._observations:
+            return False
+        return (len(self._observations) >= self.flush_every
+                or time.monotonic() - self._window_started >= self.flush_interval)
+
+    def flush(self):
+        """Write all buffered results and return the list of PriceChange they produced"""
+        if not self._observations:
+            return []
+
+        observations = self._observations
+        self._observations = {}
+        self._window_started = None
+
+        try:
+            changes = self._write(observations)
+            self.db.session.commit()
+            self.commits += 1
+            self.products_written += len(observations)
+            get_product_cache().apply_writes(
+                {product_id: checked_at for product_id, (_, _, checked_at) in observations.items()}, changes
+            )
+            http_cache.bump(http_cache.PRODUCTS)
+            if changes:
+                http_cache.bump(http_cache.HISTORY)
+            return changes
+        except Exception as e:
+            self.db.session.rollback()
+            # Make sure the next poll re-applies these responses instead of skipping them
+            for target, _, _ in observations.values():
+                invalidate_price_cache(target.url)
+            logger.error(f"Error writing results for {len(observations)} products: {str(e)}")
+            return []
+
+    def _write(self, observations):
+        """Stage last_checked updates, size updates and history inserts in the session"""
+        session = self.db.session
+
+        # A Core executemany, which (unlike bulk_update_mappings) does not fail when a
+        # product was deleted while its result sat in the buffer
+        session.execute(
+            update(Product.__table__)
+            .where(Product.__table__.c.id == bindparam('product_id'))
+            .values(last_checked=bindparam('checked_at')),
+            [{'product_id': product_id, 'checked_at': checked_at} for product_id, (_, _, checked_at) in observations.items()]
+        )
+        # The update holds the write lock, so products that still exist now stay until the commit
+        existing = {product_id for (product_id,) in session.query(Product.id).filter(Product.id.in_(list(observations)))}
+        for product_id in set(observations) - existing:
+            del observations[product_id]
+
+        priced = {
+            product_id: observation
+            for product_id, observation in observations.items()
+            if observation[1] is not PRICES_UNCHANGED
+        }
+        unchanged = [
+            (product_id, checked_at)
+            for product_id, (_, prices, checked_at) in observations.items()
+            if prices is PRICES_UNCHANGED
+        ]
+        if not priced:
+            price_intervals.record(session, [], unchanged)
+            return []
+
+        # Load every size of the batch in a single query
+        sizes = Size.query.filter(Size.product_id.in_(list(priced))).all()
+
+        changes = []
+        history_rows = []
+        observed = []
+        for size in sizes:
+            target, current_prices, checked_at = priced[size.product_id]
+            if size.size not in current_prices:
+                continue
+
+            current_price = current_prices[size.size]
+            observed.append((size.id, current_price, checked_at))
+            if size.current_price == current_price:
+                continue
+
+            logger.info(f"Price changed for {target.name} size {size.size}: {size.current_price} -> {current_price}")
+
+            history_rows.append({'size_id': size.id, 'price': current_price, 'timestamp': checked_at, 'old_price': size.current_price})
+
+            # Update size information
+            old_price = size.current_price
+            size.previous_price = old_price
+            size.current_price = current_price
+
+            # Update lowest/highest price
+            if size.lowest_price is None or current_price < size.lowest_price:
+                size.lowest_price = current_price
+            if size.highest_price is None or current_price > size.highest_price:
+                size.highest_price = current_price
+
+            size.last_updated = checked_at
+
+            changes.append(PriceChange(
+                product_id=target.id,
+                product_name=target.name,
+                product_url=target.url,
+                size_id=size.id,
+                size=size.size,
+                old_price=old_price,
+                new_price=current_price,
+                notify_below=size.notify_below,
+                notify_above=size.notify_above,
+                notify_drop_percent=size.notify_drop_percent,
+                notify_on_any_change=size.notify_on_any_change,
+                timestamp=checked_at
+            ))
+
+        if history_rows:
+            session.bulk_insert_mappings(PriceHistory, [
+                {'size_id': row['size_id'], 'price': row['price'], 'timestamp': row['timestamp']} for row in history_rows
+            ])
+            price_rollups.record(session, history_rows)
+        price_intervals.record(session, observed, unchanged)
+
+        return changes
@@ -0,0 +1,337 @@
+"""Benchmark the monitor's scrape -> diff -> persist -> notify pipeline.
+
+Runs monitor.run_sweep and the notification dispatcher against a local
+stand-in server that serves synthetic minPriceOfSizeList payloads and fake
+Discord/Chatwork/LINE endpoints, and writes the results as JSON so they can
+be compared across commits.
+
+    python benchmark.py                       # 100, 1k and 10k products
+    python benchmark.py --products 1000 --sweeps 5 --output before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure logging
+logger = logging.getLogger("snidan_benchmark")
+
+DEFAULT_CATALOGS = (100, 1000, 10000)
+DEFAULT_SWEEPS = 3
+DEFAULT_SIZES = 10
+# Fraction of products whose price moves between two sweeps
+DEFAULT_CHANGE_RATE = 0.05
+# Raw Snidan size codes 22..41 map to 25cm..34.5cm
+FIRST_SIZE_CODE = 22
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Local server playing the Snidan size list API and the notification services"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, products, sizes, seed=0):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.sizes = sizes
+        self.random = random.Random(seed)
+        # Per-product price offset, bumped for the products that move between sweeps
+        self.offsets = [0] * (products + 1)
+        self.notifications = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def move_prices(self, change_rate):
+        """Change the price of a random share of the products"""
+        count = int(round((len(self.offsets) - 1) * change_rate))
+        for product_id in self.random.sample(range(1, len(self.offsets)), count):
+            self.offsets[product_id] += 1
+
+    def size_list(self, product_id):
+        """Return the size list payload for a product"""
+        offset = self.offsets[product_id] if product_id < len(self.offsets) else 0
+        return {
+            'data': {
+                'minPriceOfSizeList': [
+                    {'size': FIRST_SIZE_CODE + i, 'price': base_price(product_id, i) - offset * 500}
+                    for i in range(self.sizes)
+                ]
+            }
+        }
+
+    def count_notification(self):
+        with self._lock:
+            self.notifications += 1
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Request handler for StandInServer"""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which stalls keep-alive clients on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # /v1/sneakers/<id>/size/list
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 5 and parts[:2] == ["v1", "sneakers"] and parts[3:] == ["size", "list"]:
+            body = json.dumps(self.server.size_list(int(parts[2]))).encode("utf-8")
+            self._reply(200, body)
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.count_notification()
+        if self.path.startswith("/discord/"):
+            self._reply(204)
+        elif self.path.startswith("/chatwork/"):
+            self._reply(200, b'{"message_id": "1"}')
+        elif self.path.startswith("/line/"):
+            self._reply(200, b"{}")
+        else:
+            self._reply(404)
+
+
+def base_price(product_id, size_index):
+    """Return the starting price of a product size"""
+    return 20000 + (product_id % 50) * 1000 + size_index * 100
+
+
+def peak_rss_mb():
+    """Return this process's peak resident memory in MB, or None when unknown"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and KiB elsewhere
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def seed_database(db, server, products, sizes):
+    """Create the products, sizes and notification settings of the synthetic catalog"""
+    from models import Product, Size, NotificationSettings
+    from scraper import _size_label
+
+    db.session.bulk_insert_mappings(Product, [
+        {'id': product_id, 'url': f"{server.base_url}/products/{product_id}", 'name': f"Benchmark product {product_id}", 'is_active': True}
+        for product_id in range(1, products + 1)
+    ])
+    db.session.bulk_insert_mappings(Size, [
+        {
+            'product_id': product_id,
+            'size': _size_label(FIRST_SIZE_CODE + i),
+            'current_price': base_price(product_id, i),
+            # Half the sizes notify on any change, the other half on a threshold
+            'notify_on_any_change': i % 2 == 0,
+            'notify_below': base_price(product_id, i) - 400 if i % 2 else None
+        }
+        for product_id in range(1, products + 1)
+        for i in range(sizes)
+    ])
+    db.session.add(NotificationSettings(
+        line_enabled=True, line_token="benchmark", line_user_id="benchmark",
+        discord_enabled=True, discord_webhook=f"{server.base_url}/discord/webhook",
+        chatwork_enabled=True, chatwork_token="benchmark", chatwork_room_id="1"
+    ))
+    db.session.commit()
+
+
+def run_catalog(products, sweeps, sizes, change_rate, workers=None):
+    """Benchmark one catalog size in this process and return its result dict"""
+    server = StandInServer(products, sizes)
+    threading.Thread(target=server.serve_forever, name="benchmark-server", daemon=True).start()
+    # Notifier endpoints are read at import time, so point them at the stand-in first
+    os.environ["LINE_API_ENDPOINT"] = f"{server.base_url}/line"
+    os.environ["CHATWORK_API_BASE"] = f"{server.base_url}/chatwork"
+
+    data_dir = tempfile.mkdtemp(prefix="snidan_benchmark_")
+    try:
+        from flask import Flask
+        from sqlalchemy import event
+        from database import db, init_app
+        from models import Product
+        from poller import PricePoller, ProductTarget
+        from monitor import run_sweep
+        from notification_queue import start_dispatcher
+
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(data_dir, 'benchmark.db')}"
+        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        init_app(app)
+
+        with app.app_context():
+            db.create_all()
+            seed_database(db, server, products, sizes)
+
+            commits = []
+            event.listen(db.engine, "commit", lambda conn: commits.append(1))
+
+            targets = [ProductTarget(*row) for row in db.session.query(Product.id, Product.name, Product.url).all()]
+            # A sweep must never be cut short by the deadline while benchmarking
+            poller = PricePoller(max_workers=workers, sweep_deadline=24 * 3600)
+            dispatcher = start_dispatcher(app, db)
+
+            sweep_results = []
+            latencies = []
+            try:
+                for index in range(sweeps):
+                    # The first sweep sees every product for the first time
+                    if index:
+                        server.move_prices(change_rate)
+                    notifications_before = server.notifications
+                    del commits[:]
+                    sweep = run_sweep(db, poller, targets)
+                    # Notifications are delivered in the background, so time the queue drain separately
+                    drain_started = time.monotonic()
+                    dispatcher.wait_idle()
+                    drain_seconds = time.monotonic() - drain_started
+                    latencies.extend(sweep.latencies)
+                    sweep_results.append({
+                        'seconds': round(sweep.elapsed, 4),
+                        'products_per_sec': round(len(targets) / sweep.elapsed, 2) if sweep.elapsed else None,
+                        'checked': sweep.checked,
+                        'unchanged': sweep.unchanged,
+                        'commits': len(commits),
+                        'notifications': server.notifications - notifications_before,
+                        'notify_drain_seconds': round(drain_seconds, 4)
+                    })
+                    logger.info(f"{products} products, sweep {index + 1}/{sweeps}: {sweep_results[-1]}")
+            finally:
+                poller.shutdown()
+                dispatcher.stop()
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    total_seconds = sum(sweep['seconds'] for sweep in sweep_results)
+    p50 = percentile(latencies, 0.50)
+    p99 = percentile(latencies, 0.99)
+    return {
+        'products': products,
+        'sizes_per_product': sizes,
+        'sweeps': sweep_results,
+        'products_per_sec': round(products * len(sweep_results) / total_seconds, 2) if total_seconds else None,
+        'latency_ms': {
+            'p50': round(p50 * 1000, 3) if p50 is not None else None,
+            'p99': round(p99 * 1000, 3) if p99 is not None else None
+        },
+        'commits_per_sweep': round(sum(sweep['commits'] for sweep in sweep_results) / len(sweep_results), 2) if sweep_results else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None
+    }
+
+
+def git_revision():
+    """Return the current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_isolated(products, args):
+    """Run one catalog in a child process so peak RSS is measured per catalog"""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--products", str(products), "--sweeps", str(args.sweeps),
+        "--sizes", str(args.sizes), "--change-rate", str(args.change_rate)
+    ]
+    if args.workers:
+        command += ["--workers", str(args.workers)]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise RuntimeError(f"Benchmark of {products} products failed")
+    return json.loads(completed.stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the price monitoring pipeline")
+    parser.add_argument("--products", type=int, action="append", help="catalog size (repeatable, default 100, 1000 and 10000)")
+    parser.add_argument("--sweeps", type=int, default=DEFAULT_SWEEPS, help="sweeps per catalog")
+    parser.add_argument("--sizes", type=int, default=DEFAULT_SIZES, help="sizes per product")
+    parser.add_argument("--change-rate", type=float, default=DEFAULT_CHANGE_RATE, help="share of products whose price moves between sweeps")
+    parser.add_argument("--workers", type=int, help="poller worker threads (default MONITOR_WORKERS)")
+    parser.add_argument("--output", default="benchmark_results.json", help="file to write the JSON results to")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # Keep the pipeline's own logging out of the measurements
+        logging.disable(logging.CRITICAL)
+        result = run_catalog(args.products[0], args.sweeps, args.sizes, args.change_rate, args.workers)
+        json.dump(result, sys.stdout)
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    results = []
+    for products in args.products or DEFAULT_CATALOGS:
+        logger.info(f"Benchmarking {products} products")
+        results.append(run_isolated(products, args))
+        logger.info(f"{products} products: {results[-1]['products_per_sec']} products/sec, "
+                    f"p50 {results[-1]['latency_ms']['p50']} ms, p99 {results[-1]['latency_ms']['p99']} ms, "
+                    f"{results[-1]['commits_per_sweep']} commits/sweep, peak RSS {results[-1]['peak_rss_mb']} MB")
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'sweeps': args.sweeps,
+            'sizes_per_product': args.sizes,
+            'change_rate': args.change_rate,
+            'workers': args.workers
+        },
+        'results': results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
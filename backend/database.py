@@ -1,7 +1,9 @@
 import os
 import json
+import sqlite3
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from flask_sqlalchemy import SQLAlchemy
@@ -18,6 +20,27 @@ Session = sessionmaker(bind=engine)
 # Initialize SQLAlchemy
 db = SQLAlchemy()
 
+# SQLite performance profile applied to every new connection (can be overridden in .env).
+# WAL lets the API threads read while the monitor thread writes.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': os.getenv('SQLITE_CACHE_SIZE', '-65536'),  # Negative values are KiB (64 MiB)
+    'mmap_size': os.getenv('SQLITE_MMAP_SIZE', '268435456'),  # 256 MiB
+    'busy_timeout': os.getenv('SQLITE_BUSY_TIMEOUT', '5000'),  # Milliseconds
+    'temp_store': 'MEMORY',
+}
+
+@event.listens_for(Engine, "connect")
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the SQLite performance profile to a new connection"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
 class Product(Base):
     """Model for storing product information"""
     __tablename__ = 'products'
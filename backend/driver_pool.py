@@ -0,0 +1,267 @@
+import os
+import glob
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from scraper import setup_driver, quit_driver, ensure_logged_in, PROFILE_DIR_PREFIX
+
+try:
+    import psutil
+except ImportError:  # Memory based recycling is disabled without psutil
+    psutil = None
+
+# Configure logging
+logger = logging.getLogger("snidan_driver_pool")
+
+# Driver pool settings (can be overridden in .env)
+DEFAULT_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", "2"))
+DEFAULT_MAX_USES = int(os.getenv("DRIVER_MAX_USES", "50"))
+DEFAULT_MAX_MEMORY_MB = int(os.getenv("DRIVER_MAX_MEMORY_MB", "1024"))
+DEFAULT_CHECKOUT_TIMEOUT = float(os.getenv("DRIVER_CHECKOUT_TIMEOUT", "120"))
+PROFILE_MAX_AGE_HOURS = float(os.getenv("DRIVER_PROFILE_MAX_AGE_HOURS", "6"))
+
+
+class PooledDriver:
+    """A pooled WebDriver and its bookkeeping"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.created_at = time.time()
+        self.uses = 0
+        self.logged_in_as = None
+
+    @property
+    def profile_dir(self):
+        return getattr(self.driver, "profile_dir", None)
+
+
+def driver_memory_mb(driver):
+    """Return the resident memory of chromedriver and its browser processes in MB"""
+    if psutil is None:
+        return None
+    try:
+        process = psutil.Process(driver.service.process.pid)
+        processes = [process] + process.children(recursive=True)
+        return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def cleanup_stale_profiles(active_dirs=(), max_age_hours=None):
+    """Remove leftover Chrome profile directories that no live driver is using"""
+    max_age = (max_age_hours if max_age_hours is not None else PROFILE_MAX_AGE_HOURS) * 3600
+    active = set(active_dirs)
+    removed = 0
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), PROFILE_DIR_PREFIX + "*")):
+        if path in active or not os.path.isdir(path):
+            continue
+        try:
+            if time.time() - os.path.getmtime(path) < max_age:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} stale Chrome profile directories")
+    return removed
+
+
+class DriverPool:
+    """Bounded pool of headless, logged-in Chrome drivers"""
+
+    def __init__(self, size=None, max_uses=None, max_memory_mb=None, checkout_timeout=None):
+        self.size = max(1, size or DEFAULT_POOL_SIZE)
+        self.max_uses = max_uses or DEFAULT_MAX_USES
+        self.max_memory_mb = max_memory_mb or DEFAULT_MAX_MEMORY_MB
+        self.checkout_timeout = checkout_timeout or DEFAULT_CHECKOUT_TIMEOUT
+        self._idle = []
+        self._in_use = set()
+        self._launching = 0
+        self._recycled = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def _total(self):
+        return len(self._idle) + len(self._in_use) + self._launching
+
+    def _launch(self, username=None, password=None):
+        """Start a new headless driver, logged in when credentials are given"""
+        entry = PooledDriver(setup_driver(headless=True))
+        if username and password:
+            self._login(entry, username, password)
+        logger.info(f"Launched pooled driver (profile {entry.profile_dir})")
+        return entry
+
+    def _login(self, entry, username, password):
+        """Log the driver in unless it already is, returning True on success"""
+        if entry.logged_in_as == username:
+            return True
+        entry.logged_in_as = username if ensure_logged_in(entry.driver, username, password) else None
+        return entry.logged_in_as is not None
+
+    def _destroy(self, entry):
+        """Quit a driver and remove its profile"""
+        quit_driver(entry.driver)
+
+    def _is_healthy(self, entry):
+        """Return True when the browser still responds"""
+        try:
+            entry.driver.current_url
+            return bool(entry.driver.window_handles)
+        except Exception:
+            return False
+
+    def _needs_recycle(self, entry):
+        """Return True once a driver has been used too often or grown too large"""
+        if entry.uses >= self.max_uses:
+            return True
+        memory = driver_memory_mb(entry.driver)
+        return memory is not None and memory > self.max_memory_mb
+
+    def checkout(self, username=None, password=None, timeout=None):
+        """Take a healthy driver from the pool, launching one if there is room.
+
+        Raises TimeoutError when no driver becomes available in time.
+        """
+        deadline = time.monotonic() + (timeout or self.checkout_timeout)
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError("Driver pool is closed")
+                entry = None
+                while entry is None:
+                    if self._idle:
+                        entry = self._idle.pop()
+                    elif self._total() < self.size:
+                        self._launching += 1
+                        break
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError("No WebDriver available in the pool")
+                        self._condition.wait(remaining)
+
+            if entry is None:
+                # Launch outside the lock, since starting Chrome takes seconds
+                try:
+                    entry = self._launch(username, password)
+                except Exception:
+                    with self._condition:
+                        self._launching -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._launching -= 1
+                    self._in_use.add(entry)
+            else:
+                with self._condition:
+                    self._in_use.add(entry)
+                if not self._is_healthy(entry):
+                    logger.warning("Discarding unhealthy pooled driver")
+                    self.checkin(entry, discard=True)
+                    continue
+
+            if username and password:
+                self._login(entry, username, password)
+            entry.uses += 1
+            return entry
+
+    def checkin(self, entry, discard=False):
+        """Return a driver to the pool, recycling it when it is worn out"""
+        with self._condition:
+            self._in_use.discard(entry)
+        if discard or self._closed or self._needs_recycle(entry):
+            self._destroy(entry)
+            self._recycled += 1
+        else:
+            with self._condition:
+                self._idle.append(entry)
+        with self._condition:
+            self._condition.notify()
+
+    @contextmanager
+    def driver(self, username=None, password=None, timeout=None):
+        """Check out a driver for the duration of a with block"""
+        entry = self.checkout(username, password, timeout)
+        failed = False
+        try:
+            yield entry.driver
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.checkin(entry, discard=failed and not self._is_healthy(entry))
+
+    def is_logged_in(self, driver):
+        """Return True when a checked out driver holds a Snidan login"""
+        with self._condition:
+            entries = list(self._in_use)
+        return any(entry.driver is driver and entry.logged_in_as for entry in entries)
+
+    def warm(self, username=None, password=None):
+        """Pre-launch drivers in the background until the pool is full"""
+        def fill():
+            while True:
+                with self._condition:
+                    if self._closed or self._total() >= self.size:
+                        return
+                    self._launching += 1
+                try:
+                    entry = self._launch(username, password)
+                except Exception as e:
+                    logger.error(f"Error pre-launching driver: {str(e)}")
+                    with self._condition:
+                        self._launching -= 1
+                    return
+                with self._condition:
+                    self._launching -= 1
+                    self._idle.append(entry)
+                    self._condition.notify()
+
+        cleanup_stale_profiles(self.active_profile_dirs())
+        threading.Thread(target=fill, name="driver-pool-warmup", daemon=True).start()
+
+    def active_profile_dirs(self):
+        """Return the profile directories of every live driver"""
+        with self._condition:
+            entries = self._idle + list(self._in_use)
+        return [entry.profile_dir for entry in entries if entry.profile_dir]
+
+    def stats(self):
+        """Return pool usage statistics"""
+        with self._condition:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'launching': self._launching,
+                'recycled': self._recycled
+            }
+
+    def close(self):
+        """Quit every idle driver; checked out drivers are quit when returned"""
+        with self._condition:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._condition.notify_all()
+        for entry in idle:
+            self._destroy(entry)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_driver_pool():
+    """Return the process-wide driver pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DriverPool()
+            cleanup_stale_profiles()
+        return _pool
@@ -0,0 +1,173 @@
+import os
+import gzip
+import time
+import functools
+import threading
+from collections import OrderedDict
+from flask import request, make_response, Response
+
+try:
+    import brotli
+except ImportError:  # Responses are gzip'd only without brotli
+    brotli = None
+
+# Response caching settings (can be overridden in .env)
+# Bodies smaller than this many bytes are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.getenv("HTTP_COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("HTTP_COMPRESS_LEVEL", "6"))
+# Fast brotli qualities compress JSON better than gzip at a similar cost
+BROTLI_QUALITY = int(os.getenv("HTTP_BROTLI_QUALITY", "4"))
+# Most encoded response bodies kept to answer repeated requests without rebuilding them
+RESPONSE_CACHE_SIZE = int(os.getenv("HTTP_RESPONSE_CACHE_SIZE", "256"))
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+# Data versions: each is bumped after a commit that changes what its endpoints return.
+# The process start is part of every ETag, so counters restarting at 0 never match an old one.
+PRODUCTS = 'products'
+HISTORY = 'history'
+NOTIFICATIONS = 'notifications'
+
+_started = format(int(time.time()), 'x')
+_versions = {PRODUCTS: 0, HISTORY: 0, NOTIFICATIONS: 0}
+_versions_lock = threading.Lock()
+
+
+def bump(*scopes):
+    """Mark the data behind the given scopes as changed"""
+    with _versions_lock:
+        for scope in scopes:
+            _versions[scope] += 1
+
+
+def etag(scopes):
+    """Return the current entity tag of data covered by the given scopes"""
+    with _versions_lock:
+        return '-'.join([_started] + [f"{scope[0]}{_versions[scope]}" for scope in scopes])
+
+
+def negotiate_encoding():
+    """Pick the content coding for the current request: br, gzip or None"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(response, encoding=None):
+    """Compress a response body in place when it is large enough and the client accepts it"""
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+
+    # Whether or not this one is compressed, the body depends on Accept-Encoding
+    response.vary.add('Accept-Encoding')
+    encoding = encoding or negotiate_encoding()
+    body = response.get_data()
+    if encoding is None or len(body) < COMPRESS_MIN_SIZE:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class ResponseCache:
+    """LRU of encoded response bodies, keyed by URL, entity tag and content coding.
+
+    An entry is only found while its entity tag is current, so stale
+    entries are never served; they are simply evicted as new ones come in.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max(1, max_entries or RESPONSE_CACHE_SIZE)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified
+            }
+
+
+_cache = ResponseCache()
+
+
+def get_response_cache():
+    """Return the process-wide response cache"""
+    return _cache
+
+
+def conditional(*scopes):
+    """Decorate a read-only view so it answers with ETags, 304s and cached compressed bodies.
+
+    The entity tag is taken before the view runs, so a change committed
+    while the response is built makes the next request rebuild it.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            tag = etag(scopes)
+            if request.if_none_match.contains_weak(tag):
+                _cache.count_not_modified()
+                response = Response(status=304)
+                response.set_etag(tag, weak=True)
+                response.headers['Cache-Control'] = 'private, no-cache'
+                response.vary.add('Accept-Encoding')
+                return response
+
+            encoding = negotiate_encoding()
+            key = (request.full_path, tag, encoding)
+            entry = _cache.get(key)
+            if entry is not None:
+                body, headers = entry
+                return Response(body, status=200, headers=headers)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(tag, weak=True)
+            # Browsers revalidate on every request and are answered with 304 while nothing changed
+            response.headers['Cache-Control'] = 'private, no-cache'
+            compress(response, encoding)
+            _cache.put(key, (response.get_data(), list(response.headers)))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,99 @@
+import os
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configure logging
+logger = logging.getLogger("snidan_http")
+
+# HTTP settings (can be overridden in .env)
+DEFAULT_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+
+
+class PooledSession(requests.Session):
+    """requests.Session with a bounded keep-alive pool and default timeouts"""
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, headers=None):
+        super().__init__()
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.timeout = (connect_timeout or DEFAULT_CONNECT_TIMEOUT, read_timeout or DEFAULT_READ_TIMEOUT)
+
+        # pool_block makes extra threads wait for a free connection instead of opening throwaway ones
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, pool_block=True)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+        self.headers.update({"Connection": "keep-alive"})
+        if headers:
+            self.headers.update(headers)
+
+    def request(self, method, url, **kwargs):
+        """Send a request, applying the default timeouts when none are given"""
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+    def pool_stats(self):
+        """Return connection pool statistics for this session"""
+        requests_sent = 0
+        connections_opened = 0
+        idle_connections = 0
+        hosts = {}
+
+        for adapter in set(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host_idle = pool.pool.qsize() if pool.pool is not None else 0
+                hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                    "requests": pool.num_requests,
+                    "connections_opened": pool.num_connections,
+                    "idle_connections": host_idle,
+                }
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+                idle_connections += host_idle
+
+        reused = max(requests_sent - connections_opened, 0)
+        return {
+            "pool_size": self.pool_size,
+            "requests": requests_sent,
+            "connections_opened": connections_opened,
+            "open_connections": idle_connections,
+            "reuse_ratio": round(reused / requests_sent, 4) if requests_sent else 0.0,
+            "hosts": hosts,
+        }
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name, **kwargs):
+    """Return the shared session registered under name, creating it on first use"""
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = PooledSession(**kwargs)
+            _sessions[name] = session
+            logger.info(f"Created HTTP session '{name}' with pool size {session.pool_size}")
+        return session
+
+
+def get_pool_stats():
+    """Return pool statistics for every shared session"""
+    with _sessions_lock:
+        sessions = dict(_sessions)
+    return {name: session.pool_stats() for name, session in sessions.items()}
+
+
+def close_sessions():
+    """Close every shared session and its pooled connections"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
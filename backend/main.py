@@ -9,13 +9,14 @@ from flask import Flask, render_template, request, redirect, url_for, flash, jso
 from dotenv import load_dotenv
 from flask_cors import CORS  # Import CORS
 
+# Load environment variables (before importing modules that read settings at import time)
+load_dotenv()
+
 # Import database
 from database import db, init_app
 
 import scraper
-
-# Load environment variables
-load_dotenv()
+import http_cache
 
 # Configure logging
 logging.basicConfig(
@@ -43,7 +44,8 @@ def add_cors_headers(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-    return response
+    # Large bodies are sent with gzip/brotli (already done for cached responses)
+    return http_cache.compress(response)
 
 # Get the absolute path to the data directory
 data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
@@ -67,6 +69,8 @@ from routes import register_routes
 
 # Import monitoring functionality (will be defined in monitor.py)
 from monitor import start_monitoring, stop_monitoring
+from notification_queue import start_dispatcher
+from retention import start_retention
 
 # Register routes
 register_routes(app, db)
@@ -86,8 +90,21 @@ def update_last_startup():
 # Use a function to initialize the app
 def init_app_startup():
     """Initialize the app on startup"""
+    # Create the database, or bring an existing one up to the current schema
+    import setup
+    if os.path.exists(db_path):
+        setup.migrate_database()
+    else:
+        setup.initialize_database()
+    
     update_last_startup()
     
+    # Deliver queued notifications independently of the monitor loop
+    start_dispatcher(app, db)
+    
+    # Archive and prune expired price history in the background
+    start_retention(app, db)
+    
     # Start monitoring in a separate thread
     global monitoring_thread, stop_event
     if monitoring_thread is None or not monitoring_thread.is_alive():
@@ -1,3 +1,4 @@
+import json
 import datetime
 from database import db
 
@@ -91,6 +92,9 @@ class Product(db.Model):
     added_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     last_checked = db.Column(db.DateTime)
     is_active = db.Column(db.Boolean, default=True)
+    # Per-product polling limits in seconds (None uses the global defaults)
+    min_interval = db.Column(db.Integer)
+    max_interval = db.Column(db.Integer)
     
     # Relationships
     sizes = db.relationship('Size', backref='product', lazy=True, cascade="all, delete-orphan")
@@ -108,6 +112,8 @@ class Product(db.Model):
             'added_at': self.added_at.isoformat() if self.added_at else None,
             'last_checked': self.last_checked.isoformat() if self.last_checked else None,
             'is_active': self.is_active,
+            'min_interval': self.min_interval,
+            'max_interval': self.max_interval,
             'sizes': [size.to_dict() for size in self.sizes]
         }
 
@@ -123,6 +129,7 @@ class Size(db.Model):
     highest_price = db.Column(db.Integer)
     notify_below = db.Column(db.Integer)
     notify_above = db.Column(db.Integer)
+    notify_drop_percent = db.Column(db.Float)  # Alert when the price falls by at least this percentage
     notify_on_any_change = db.Column(db.Boolean, default=False)
     last_updated = db.Column(db.DateTime)
     
@@ -146,6 +153,7 @@ class Size(db.Model):
             'highest_price': self.highest_price,
             'notify_below': self.notify_below,
             'notify_above': self.notify_above,
+            'notify_drop_percent': self.notify_drop_percent,
             'notify_on_any_change': self.notify_on_any_change,
             'last_updated': self.last_updated.isoformat() if self.last_updated else None
         }
@@ -158,6 +166,8 @@ class PriceHistory(db.Model):
     price = db.Column(db.Integer, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_price_history_size_timestamp', 'size_id', 'timestamp'),)
+    
     def __repr__(self):
         return f"<PriceHistory {self.price} for Size {self.size_id}>"
     
@@ -177,10 +187,19 @@ class NotificationHistory(db.Model):
     size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), nullable=False)
     old_price = db.Column(db.Integer)
     new_price = db.Column(db.Integer)
-    notification_type = db.Column(db.String(50))  # 'below', 'above', 'change'
+    notification_type = db.Column(db.String(50))  # 'below', 'above', 'drop', 'change'
     sent_to = db.Column(db.String(50))  # 'line', 'discord', 'chatwork'
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
+    # SQLite appends the row id to every index, so these serve keyset paging on (timestamp, id)
+    __table_args__ = (
+        db.Index('ix_notification_history_timestamp', 'timestamp'),
+        db.Index('ix_notification_history_product_timestamp', 'product_id', 'timestamp'),
+        db.Index('ix_notification_history_size_timestamp', 'size_id', 'timestamp'),
+        db.Index('ix_notification_history_sent_to_timestamp', 'sent_to', 'timestamp'),
+        db.Index('ix_notification_history_type_timestamp', 'notification_type', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f"<NotificationHistory {self.notification_type} for Product {self.product_id}>"
     
@@ -194,4 +213,166 @@ class NotificationHistory(db.Model):
             'notification_type': self.notification_type,
             'sent_to': self.sent_to,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
-        } 
\ No newline at end of file
+        } 
+class OutboundNotification(db.Model):
+    """Notification waiting to be delivered to one service"""
+    __tablename__ = 'notification_queue'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), nullable=False)
+    old_price = db.Column(db.Integer)
+    new_price = db.Column(db.Integer)
+    notification_type = db.Column(db.String(50))  # 'below', 'above', 'change'
+    service = db.Column(db.String(50), nullable=False)  # 'line', 'discord', 'chatwork'
+    group_key = db.Column(db.String(50))  # 'product:<id>' or 'digest' for coalesced messages
+    details = db.Column(db.Text)  # JSON list of the price changes in the message
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending' (delivered messages are deleted, failed ones dead-lettered)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.datetime.now)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (db.Index('ix_notification_queue_status_next_attempt', 'status', 'next_attempt_at'),)
+    
+    def __repr__(self):
+        return f"<OutboundNotification {self.service} {self.status} for Product {self.product_id}>"
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'size_id': self.size_id,
+            'old_price': self.old_price,
+            'new_price': self.new_price,
+            'notification_type': self.notification_type,
+            'service': self.service,
+            'group_key': self.group_key,
+            'changes': len(json.loads(self.details)) if self.details else 1,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
+        }
+
+class NotificationDeadLetter(db.Model):
+    """Notification that could not be delivered after all retries"""
+    __tablename__ = 'notification_dead_letters'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), nullable=False)
+    old_price = db.Column(db.Integer)
+    new_price = db.Column(db.Integer)
+    notification_type = db.Column(db.String(50))
+    service = db.Column(db.String(50), nullable=False)
+    group_key = db.Column(db.String(50))
+    details = db.Column(db.Text)
+    message = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    status_code = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime)  # When the notification was first queued
+    failed_at = db.Column(db.DateTime, default=datetime.datetime.now)
+    replayed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (db.Index('ix_notification_dead_letters_failed_at', 'failed_at'),)
+    
+    def __repr__(self):
+        return f"<NotificationDeadLetter {self.service} for Product {self.product_id}>"
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'size_id': self.size_id,
+            'old_price': self.old_price,
+            'new_price': self.new_price,
+            'notification_type': self.notification_type,
+            'service': self.service,
+            'group_key': self.group_key,
+            'changes': len(json.loads(self.details)) if self.details else 1,
+            'message': self.message,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'status_code': self.status_code,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'failed_at': self.failed_at.isoformat() if self.failed_at else None,
+            'replayed_at': self.replayed_at.isoformat() if self.replayed_at else None
+        }
+
+class AlertState(db.Model):
+    """Last alert sent for a size, used to suppress repeated alerts on flickering prices"""
+    __tablename__ = 'alert_state'
+    size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), primary_key=True)
+    last_alert_type = db.Column(db.String(50))
+    last_alerted_price = db.Column(db.Integer)
+    last_alerted_at = db.Column(db.DateTime)
+    # A threshold alert disarms its rule until the price moves back past the hysteresis band
+    below_armed = db.Column(db.Boolean, nullable=False, default=True)
+    above_armed = db.Column(db.Boolean, nullable=False, default=True)
+    
+    def __repr__(self):
+        return f"<AlertState for Size {self.size_id}>"
+    
+    def to_dict(self):
+        return {
+            'size_id': self.size_id,
+            'last_alert_type': self.last_alert_type,
+            'last_alerted_price': self.last_alerted_price,
+            'last_alerted_at': self.last_alerted_at.isoformat() if self.last_alerted_at else None,
+            'below_armed': self.below_armed,
+            'above_armed': self.above_armed
+        }
+
+class PriceRollup(db.Model):
+    """Open/high/low/close of a size's price over one hour or one day, kept up to date as history is written"""
+    __tablename__ = 'price_rollups'
+    size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), primary_key=True)
+    period = db.Column(db.Integer, primary_key=True)  # Bucket width in seconds: 3600 or 86400
+    bucket_start = db.Column(db.Integer, primary_key=True)  # Epoch seconds, a multiple of period
+    open_price = db.Column(db.Integer)
+    high_price = db.Column(db.Integer)
+    low_price = db.Column(db.Integer)
+    close_price = db.Column(db.Integer)
+    change_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<PriceRollup {self.period}s at {self.bucket_start} for Size {self.size_id}>"
+    
+    def to_dict(self):
+        return {
+            'size_id': self.size_id,
+            'period': self.period,
+            'bucket_start': self.bucket_start,
+            'open_price': self.open_price,
+            'high_price': self.high_price,
+            'low_price': self.low_price,
+            'close_price': self.close_price,
+            'change_count': self.change_count
+        }
+
+class PriceInterval(db.Model):
+    """Span of time in which every poll of a size saw the same price"""
+    __tablename__ = 'price_intervals'
+    id = db.Column(db.Integer, primary_key=True)
+    size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), nullable=False)
+    price = db.Column(db.Integer, nullable=False)
+    valid_from = db.Column(db.DateTime, nullable=False)  # First poll that saw the price
+    valid_to = db.Column(db.DateTime, nullable=False)  # Latest poll that saw it, extended in place
+    
+    __table_args__ = (db.Index('ix_price_intervals_size_valid_from', 'size_id', 'valid_from'),)
+    
+    def __repr__(self):
+        return f"<PriceInterval {self.price} for Size {self.size_id}>"
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'size_id': self.size_id,
+            'price': self.price,
+            'valid_from': self.valid_from.isoformat() if self.valid_from else None,
+            'valid_to': self.valid_to.isoformat() if self.valid_to else None
+        }
@@ -3,19 +3,33 @@ import time
 import logging
 import datetime
 import threading
+from collections import namedtuple
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from webdriver_manager.chrome import ChromeDriverManager
 from models import Product, Size, PriceHistory, NotificationHistory, SnidanSettings, NotificationSettings
-from scraper import setup_driver, login_to_snidan, get_current_prices
-from notifier import send_notification
+from scraper import get_scraper_session, check_saved_login, PRICES_UNCHANGED
+from driver_pool import get_driver_pool
+from batch_writer import PriceWriteBuffer
+from poller import PricePoller, ProductTarget
+from scheduler import PollScheduler, load_poll_stats
+from notification_queue import enqueue_notifications
+from alert_rules import get_threshold_engine, get_alert_gate
+from price_stream import get_price_stream
 
 # Configure logging
 logger = logging.getLogger("snidan_monitor")
 
+# Outcome of one sweep: latencies are the per-product fetch times in seconds
+SweepResult = namedtuple("SweepResult", ["checked", "unchanged", "commits", "elapsed", "latencies"])
+
+# Scheduler of the running monitor (exposed for the status endpoints)
+active_scheduler = None
+
 def start_monitoring(app, db, stop_event):
     """Start the monitoring process in a separate thread"""
+    global active_scheduler
     logger.info("Starting monitoring process")
     
     with app.app_context():
@@ -31,103 +45,74 @@ def start_monitoring(app, db, stop_event):
             logger.warning("Monitoring interval too short, setting to 5 seconds")
             monitoring_interval = 5
         
-        # Set up Chrome WebDriver
+        # Price polling goes through the HTTP API, so the browser is only borrowed to log in
         driver = None
+        poller = None
         
         try:
-            driver = setup_driver()
+            pool = get_driver_pool()
+            # A still-valid saved session avoids starting a browser at all
+            logged_in = check_saved_login(snidan_settings.username)
+            if not logged_in:
+                with pool.driver(snidan_settings.username, snidan_settings.password) as login_driver:
+                    logged_in = pool.is_logged_in(login_driver)
             
             # Log in to Snidan
-            if not login_to_snidan(driver, snidan_settings.username, snidan_settings.password):
+            if not logged_in:
                 logger.error("Failed to log in to Snidan")
                 return
             
+            # Keep logged-in drivers ready for the API endpoints
+            pool.warm(snidan_settings.username, snidan_settings.password)
+            
+            poller = PricePoller()
+            
+            scheduler = PollScheduler(monitoring_interval)
+            active_scheduler = scheduler
+            
             # Main monitoring loop
             while not stop_event.is_set():
                 try:
-                    # Get active products
-                    products = Product.query.filter_by(is_active=True).all()
-                    logger.info(f"Monitoring {len(products)} active products")
-                    for product in products:
-                        if stop_event.is_set():
-                            if driver:
-                                driver.quit()
-                            break
-                        
+                    # Pick up new/deactivated products and interval changes
+                    settings = SnidanSettings.query.first()
+                    if settings and settings.monitoring_interval:
+                        scheduler.min_interval = max(settings.monitoring_interval, 5)
+                    scheduler.sync(
+                        db.session.query(Product.id, Product.min_interval, Product.max_interval)
+                        .filter_by(is_active=True)
+                        .all()
+                    )
+                    
+                    due_ids = scheduler.pop_due()
+                    if due_ids:
                         try:
-                            # Get current prices
-                            current_prices = get_current_prices(driver, product)
-                            
-                            if not current_prices:
-                                logger.warning(f"No prices found for product: {product.name}")
-                                continue
-                            
-                            # Update product last checked time
-                            product.last_checked = datetime.datetime.now()
-                            db.session.commit()
+                            targets = [
+                                ProductTarget(*row) for row in
+                                db.session.query(Product.id, Product.name, Product.url)
+                                .filter(Product.id.in_(due_ids))
+                                .all()
+                            ]
+                            logger.info(f"Polling {len(targets)} due products with {poller.max_workers} workers")
+                            sweep = run_sweep(db, poller, targets, driver, stop_event)
+                            logger.info(f"Sweep finished: {sweep.checked}/{len(targets)} products checked ({sweep.unchanged} unchanged) in {sweep.elapsed:.1f}s with {sweep.commits} commits")
+                            pool_stats = get_scraper_session().pool_stats()
+                            logger.info(f"HTTP pool: {pool_stats['requests']} requests over {pool_stats['connections_opened']} connections (reuse ratio {pool_stats['reuse_ratio']:.2f})")
                             
-                            # Check each size
-                            sizes = Size.query.filter_by(product_id=product.id).all()
-                            for size in sizes:
-                                if size.size in current_prices:
-                                    current_price = current_prices[size.size]
-                                    
-                                    # Check if price has changed
-                                    if size.current_price != current_price:
-                                        logger.info(f"Price changed for {product.name} size {size.size}: {size.current_price} -> {current_price}")
-                                        
-                                        # Update price history
-                                        price_history = PriceHistory(
-                                            size_id=size.id,
-                                            price=current_price,
-                                            timestamp=datetime.datetime.now()
-                                        )
-                                        db.session.add(price_history)
-                                        
-                                        # Update size information
-                                        old_price = size.current_price
-                                        size.previous_price = old_price
-                                        size.current_price = current_price
-                                        
-                                        # Update lowest/highest price
-                                        if size.lowest_price is None or current_price < size.lowest_price:
-                                            size.lowest_price = current_price
-                                        if size.highest_price is None or current_price > size.highest_price:
-                                            size.highest_price = current_price
-                                        
-                                        size.last_updated = datetime.datetime.now()
-                                        db.session.commit()
-                                        
-                                        # Check notification conditions
-                                        notification_sent = False
-                                        
-                                        # Notify on any change
-                                        if size.notify_on_any_change:
-                                            logger.info(f"Sending notification for any change: {product.name} size {size.size}")
-                                            send_price_change_notification(db, product, size, old_price, current_price, "change")
-                                            notification_sent = True
-                                        
-                                        # Notify if price drops below threshold
-                                        elif size.notify_below and current_price <= size.notify_below:
-                                            logger.info(f"Sending notification for price below threshold: {product.name} size {size.size}")
-                                            send_price_change_notification(db, product, size, old_price, current_price, "below")
-                                            notification_sent = True
-                                        
-                                        if not notification_sent:
-                                            logger.info(f"No notification conditions met for {product.name} size {size.size}")
-                        
-                        except Exception as e:
-                            logger.error(f"Error monitoring product {product.name}: {str(e)}")
-                            continue
+                            # Every popped product is rescheduled, including ones that failed
+                            scheduler.reschedule(load_poll_stats(db, due_ids))
+                        finally:
+                            # If the sweep or the stats query raised, the products would stay in flight for good
+                            scheduler.release(due_ids)
                     
-                    # Sleep for the monitoring interval
-                    logger.info(f"Sleeping for {monitoring_interval} seconds")
-                    for _ in range(1):
-                        if stop_event.is_set():
-                            break
-                        time.sleep(1)
+                    # Sleep until the next product is due, waking periodically to pick up new products
+                    wait_seconds = scheduler.seconds_until_next()
+                    if wait_seconds is None or wait_seconds > scheduler.min_interval:
+                        wait_seconds = scheduler.min_interval
+                    logger.debug(f"Sleeping for {wait_seconds:.1f} seconds")
+                    stop_event.wait(wait_seconds)
                 
                 except Exception as e:
+                    db.session.rollback()
                     logger.error(f"Error in monitoring loop: {str(e)}")
                     time.sleep(1)
         
@@ -135,92 +120,62 @@ def start_monitoring(app, db, stop_event):
             logger.error(f"Error in monitoring process: {str(e)}")
         
         finally:
-            if driver:
-                driver.quit()
+            if poller:
+                poller.shutdown()
             logger.info("Monitoring process stopped")
 
-def send_price_change_notification(db, product, size, old_price, new_price, notification_type):
-    """Send notification for price change"""
-    try:
-        # Get notification settings
-        notification_settings = NotificationSettings.query.first()
-        if not notification_settings:
-            logger.error("Notification settings not found")
-            return
-        
-        # Prepare notification message
-        message = f"価格変動通知: {product.name}\n"
-        message += f"サイズ: {size.size}\n"
-        message += f"旧価格: ¥{old_price:,}\n"
-        message += f"新価格: ¥{new_price:,}\n"
-        
-        price_diff = new_price - old_price
-        if price_diff < 0:
-            message += f"差額: ¥{abs(price_diff):,} 値下がり\n"
-        else:
-            message += f"差額: ¥{price_diff:,} 値上がり\n"
-        
-        message += f"商品URL: {product.url}"
-        
-        # Send notifications based on enabled services
-        notification_services = []
-        
-        if notification_settings.line_enabled and notification_settings.line_token and notification_settings.line_user_id:
-            logger.info("Sending LINE notification")
-            success = send_notification(
-                "line",
-                message,
-                {
-                    "token": notification_settings.line_token,
-                    "user_id": notification_settings.line_user_id
-                }
-            )
-            if success:
-                notification_services.append("line")
+def run_sweep(db, poller, targets, driver=None, stop_event=None):
+    """Fetch, diff, persist and notify one batch of products, returning a SweepResult"""
+    sweep_started = time.monotonic()
+    checked_count = 0
+    unchanged_count = 0
+    latencies = []
+    writer = PriceWriteBuffer(db)
+    
+    # Results are buffered here, on the monitor thread, while the workers keep fetching
+    for result in poller.poll(targets, driver, stop_event):
+        if result.elapsed is not None:
+            latencies.append(result.elapsed)
         
-        if notification_settings.discord_enabled and notification_settings.discord_webhook:
-            logger.info("Sending Discord notification")
-            success = send_notification(
-                "discord",
-                message,
-                {
-                    "webhook_url": notification_settings.discord_webhook
-                }
-            )
-            if success:
-                notification_services.append("discord")
+        if result.error:
+            logger.error(f"Error monitoring product {result.target.name}: {result.error}")
+            continue
         
-        if notification_settings.chatwork_enabled and notification_settings.chatwork_token and notification_settings.chatwork_room_id:
-            logger.info("Sending Chatwork notification")
-            success = send_notification(
-                "chatwork",
-                message,
-                {
-                    "token": notification_settings.chatwork_token,
-                    "room_id": notification_settings.chatwork_room_id
-                }
-            )
-            if success:
-                notification_services.append("chatwork")
+        if not result.prices:
+            logger.warning(f"No prices found for product: {result.target.name}")
+            continue
         
-        # Record notification in history
-        for service in notification_services:
-            notification_history = NotificationHistory(
-                product_id=product.id,
-                size_id=size.id,
-                old_price=old_price,
-                new_price=new_price,
-                notification_type=notification_type,
-                sent_to=service,
-                timestamp=datetime.datetime.now()
-            )
-            db.session.add(notification_history)
+        if result.prices is PRICES_UNCHANGED:
+            unchanged_count += 1
+        writer.add(result.target, result.prices)
+        checked_count += 1
         
-        db.session.commit()
-        logger.info(f"Notification sent to {', '.join(notification_services)}")
+        if writer.should_flush():
+            publish_price_changes(db, writer.flush())
+    
+    publish_price_changes(db, writer.flush())
+    
+    return SweepResult(checked_count, unchanged_count, writer.commits, time.monotonic() - sweep_started, latencies)
+
+def publish_price_changes(db, changes):
+    """Push committed price changes to the live stream, then queue their notifications"""
+    get_price_stream().publish(changes)
+    notify_price_changes(db, changes)
+
+def notify_price_changes(db, changes):
+    """Queue notifications for committed price changes that meet their size's conditions"""
+    if not changes:
+        return
+    
+    # All rules (below, above, percent drop, any change) are evaluated for the whole batch at once
+    alerts = get_threshold_engine(db).evaluate(changes)
+    triggered = len(alerts)
+    # Drop repeats, threshold flicker and moves within the cooldown before anything is queued
+    alerts = get_alert_gate(db).filter(changes, alerts)
+    logger.info(f"{triggered} of {len(changes)} price changes met their notification conditions, {len(alerts)} after noise suppression")
     
-    except Exception as e:
-        logger.error(f"Error sending notification: {str(e)}")
+    # Delivery happens on the notification dispatcher, so slow services never hold up the sweep
+    enqueue_notifications(db, alerts)
 
 def stop_monitoring(stop_event):
     """Stop the monitoring process"""
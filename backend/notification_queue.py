@@ -0,0 +1,617 @@
+import os
+import json
+import time
+import random
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy import inspect
+from models import NotificationSettings, NotificationHistory, OutboundNotification, NotificationDeadLetter
+from notifier import send_notification, reset_clients, DeliveryResult
+from product_cache import get_product_cache
+import http_cache
+
+# Configure logging
+logger = logging.getLogger("snidan_notification_queue")
+
+# Delivery settings (can be overridden in .env)
+DEFAULT_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+DEFAULT_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "2"))
+# Retries back off exponentially from NOTIFY_RETRY_DELAY up to NOTIFY_RETRY_MAX_DELAY seconds
+DEFAULT_RETRY_DELAY = float(os.getenv("NOTIFY_RETRY_DELAY", "5"))
+DEFAULT_RETRY_MAX_DELAY = float(os.getenv("NOTIFY_RETRY_MAX_DELAY", "600"))
+# Changes queued within this many seconds of each other are sent as one message
+COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", "0"))
+# "product" sends one message per product, "channel" one digest of all products per service
+COALESCE_BY = os.getenv("NOTIFY_COALESCE_BY", "product")
+
+# Longest message each service accepts, in characters
+MESSAGE_LIMITS = {'line': 5000, 'discord': 2000, 'chatwork': 10000}
+
+# Published rate limits as "requests/seconds": LINE push is 2,000 requests per second,
+# a Discord webhook 5 requests per 2 seconds and Chatwork 10 messages per 10 seconds per room
+RATE_LIMITS = {
+    'line': os.getenv("NOTIFY_RATE_LIMIT_LINE", "2000/1"),
+    'discord': os.getenv("NOTIFY_RATE_LIMIT_DISCORD", "5/2"),
+    'chatwork': os.getenv("NOTIFY_RATE_LIMIT_CHATWORK", "10/10"),
+}
+
+
+class TokenBucket:
+    """Token bucket allowing `capacity` requests per `period` seconds, with bursts up to capacity"""
+
+    def __init__(self, capacity, period):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Build a bucket from a "requests/seconds" string"""
+        requests, _, seconds = spec.partition("/")
+        return cls(int(requests), float(seconds or 1))
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Take a token, returning False when none is available yet"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return False
+            self._refill(now)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def seconds_until_available(self):
+        """Return how long until try_acquire can succeed"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait_tokens = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            return max(wait_tokens, self._paused_until - now, 0.0)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while, e.g. after the service answered 429"""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated = now
+
+
+def _detail(change, notification_type):
+    """Return the JSON-serialisable record of one price change in a queued message"""
+    return {
+        'product_id': change.product_id,
+        'product_name': change.product_name,
+        'product_url': change.product_url,
+        'size_id': change.size_id,
+        'size': change.size,
+        'old_price': change.old_price,
+        'new_price': change.new_price,
+        'notification_type': notification_type
+    }
+
+
+def _price_diff_text(old_price, new_price):
+    price_diff = new_price - old_price
+    if price_diff < 0:
+        return f"¥{abs(price_diff):,} 値下がり"
+    return f"¥{price_diff:,} 値上がり"
+
+
+def build_message(details):
+    """Render the notification text for the price changes of a queued message.
+
+    A single change keeps the one-size layout; several changes of a product
+    are rendered as a per-size table, one block per product.
+    """
+    if len(details) == 1:
+        detail = details[0]
+        message = f"価格変動通知: {detail['product_name']}\n"
+        message += f"サイズ: {detail['size']}\n"
+        message += f"旧価格: ¥{detail['old_price']:,}\n"
+        message += f"新価格: ¥{detail['new_price']:,}\n"
+        message += f"差額: {_price_diff_text(detail['old_price'], detail['new_price'])}\n"
+        message += f"商品URL: {detail['product_url']}"
+        return message
+
+    products = {}
+    for detail in details:
+        products.setdefault(detail['product_id'], []).append(detail)
+
+    blocks = []
+    for product_details in products.values():
+        block = f"価格変動通知: {product_details[0]['product_name']} ({len(product_details)}サイズ)\n"
+        for detail in product_details:
+            block += f"{detail['size']}: ¥{detail['old_price']:,} → ¥{detail['new_price']:,} ({_price_diff_text(detail['old_price'], detail['new_price'])})\n"
+        block += f"商品URL: {product_details[0]['product_url']}"
+        blocks.append(block)
+    return "\n\n".join(blocks)
+
+
+def enabled_services(notification_settings):
+    """Return {service: config} for every configured and enabled service"""
+    services = {}
+    if not notification_settings:
+        return services
+    if notification_settings.line_enabled and notification_settings.line_token and notification_settings.line_user_id:
+        services["line"] = {
+            "token": notification_settings.line_token,
+            "user_id": notification_settings.line_user_id
+        }
+    if notification_settings.discord_enabled and notification_settings.discord_webhook:
+        services["discord"] = {
+            "webhook_url": notification_settings.discord_webhook
+        }
+    if notification_settings.chatwork_enabled and notification_settings.chatwork_token and notification_settings.chatwork_room_id:
+        services["chatwork"] = {
+            "token": notification_settings.chatwork_token,
+            "room_id": notification_settings.chatwork_room_id
+        }
+    return services
+
+
+# Enabled services read from NotificationSettings, kept until the settings are saved again
+_services_cache = None
+_services_cache_lock = threading.Lock()
+
+
+def get_enabled_services():
+    """Return the cached {service: config} of the enabled services, loading it on first use"""
+    global _services_cache
+    with _services_cache_lock:
+        if _services_cache is None:
+            _services_cache = enabled_services(NotificationSettings.query.first())
+        return _services_cache
+
+
+def invalidate_settings_cache():
+    """Drop the cached notification settings and clients after the settings have changed"""
+    global _services_cache
+    with _services_cache_lock:
+        _services_cache = None
+    reset_clients()
+
+
+def _group_key(detail):
+    """Return the key of the message a change is coalesced into"""
+    if COALESCE_BY == "channel":
+        return "digest"
+    return f"product:{detail['product_id']}"
+
+
+def _message_id(item):
+    """Return the id of a queued message without reloading it, as it may have been deleted since"""
+    return inspect(item).identity[0]
+
+
+def _open_messages(service, group_keys, now):
+    """Return {group_key: OutboundNotification} for queued messages that can still take more changes"""
+    if COALESCE_WINDOW <= 0:
+        return {}
+    # Leave a margin so the dispatcher never claims a message while it is being extended
+    rows = OutboundNotification.query.filter(
+        OutboundNotification.service == service,
+        OutboundNotification.status == 'pending',
+        OutboundNotification.attempts == 0,
+        OutboundNotification.group_key.in_(list(group_keys)),
+        OutboundNotification.next_attempt_at > now + datetime.timedelta(seconds=1)
+    ).order_by(OutboundNotification.id).all()
+    return {row.group_key: row for row in rows}
+
+
+def _new_message(service, group_key, details, now):
+    first = details[0]
+    return OutboundNotification(
+        product_id=first['product_id'],
+        size_id=first['size_id'],
+        old_price=first['old_price'],
+        new_price=first['new_price'],
+        notification_type=first['notification_type'],
+        service=service,
+        group_key=group_key,
+        details=json.dumps(details, ensure_ascii=False),
+        message=build_message(details),
+        status='pending',
+        attempts=0,
+        created_at=now,
+        # Hold the message for the window so later changes can join it
+        next_attempt_at=now + datetime.timedelta(seconds=max(COALESCE_WINDOW, 0))
+    )
+
+
+def enqueue_notifications(db, notifications):
+    """Queue (PriceChange, notification_type) pairs for every enabled service in one transaction.
+
+    Changes are coalesced into one message per product (or one digest per
+    service) and merged into matching messages still held by the coalescing
+    window. Returns the number of changes queued.
+    """
+    if not notifications:
+        return 0
+
+    services = get_enabled_services()
+    if not services:
+        logger.warning(f"No notification service enabled, dropping {len(notifications)} notifications")
+        return 0
+
+    groups = {}
+    for change, notification_type in notifications:
+        detail = _detail(change, notification_type)
+        groups.setdefault(_group_key(detail), []).append(detail)
+
+    now = datetime.datetime.now()
+    messages = 0
+    try:
+        for service in services:
+            limit = MESSAGE_LIMITS.get(service)
+            open_messages = _open_messages(service, groups, now)
+            for group_key, details in groups.items():
+                message = open_messages.get(group_key)
+                pending = list(details)
+                if message is not None:
+                    merged = json.loads(message.details or "[]") + pending
+                    text = build_message(merged)
+                    if limit is None or len(text) <= limit:
+                        message.details = json.dumps(merged, ensure_ascii=False)
+                        message.message = text
+                        pending = []
+
+                # Split groups that would not fit in one message of this service
+                while pending:
+                    batch = pending
+                    while len(batch) > 1 and limit is not None and len(build_message(batch)) > limit:
+                        batch = batch[:len(batch) // 2]
+                    db.session.add(_new_message(service, group_key, batch, now))
+                    pending = pending[len(batch):]
+                    messages += 1
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error queueing {len(notifications)} notifications: {str(e)}")
+        return 0
+
+    logger.info(f"Queued {len(notifications)} price changes as {messages} new messages")
+    if _dispatcher is not None:
+        _dispatcher.wake()
+    return len(notifications)
+
+
+class NotificationDispatcher:
+    """Background worker that delivers queued notifications to all services in parallel.
+
+    Each service has its own token bucket, so bursts go out as fast as the
+    service allows. Failed deliveries are retried with jittered exponential
+    backoff (or after the service's Retry-After) and moved to the dead-letter
+    table once they run out of attempts.
+    """
+
+    def __init__(self, app, db, max_workers=None, max_attempts=None, poll_interval=None, retry_delay=None, retry_max_delay=None):
+        self.app = app
+        self.db = db
+        self.max_workers = max(1, max_workers or DEFAULT_WORKERS)
+        self.max_attempts = max(1, max_attempts or DEFAULT_MAX_ATTEMPTS)
+        self.poll_interval = poll_interval or DEFAULT_POLL_INTERVAL
+        self.retry_delay = retry_delay if retry_delay is not None else DEFAULT_RETRY_DELAY
+        self.retry_max_delay = retry_max_delay if retry_max_delay is not None else DEFAULT_RETRY_MAX_DELAY
+        self.buckets = {service: TokenBucket.from_spec(spec) for service, spec in RATE_LIMITS.items()}
+        self.sent = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.dead_lettered = 0
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._idle_event = threading.Event()
+        self._idle_lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+        self._in_flight = {}  # Future -> OutboundNotification being delivered
+
+    def start(self):
+        """Start the dispatcher thread unless it is already running"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="notifier")
+        self._thread = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Notification dispatcher started with {self.max_workers} workers")
+
+    def stop(self, timeout=5):
+        """Stop the dispatcher; messages still in flight are retried on the next start"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._executor:
+            for future in list(self._in_flight):
+                future.cancel()
+            self._executor.shutdown(wait=False)
+        logger.info("Notification dispatcher stopped")
+
+    def wake(self):
+        """Check the queue now instead of at the next poll"""
+        with self._idle_lock:
+            self._idle_event.clear()
+            self._wake_event.set()
+
+    def wait_idle(self, timeout=None):
+        """Block until no queued message is due (retries scheduled later do not count); returns False on timeout"""
+        self.wake()
+        return self._idle_event.wait(timeout)
+
+    def _claim(self, services, exclude_ids, limit):
+        """Return due pending messages of the given services that are not already being sent"""
+        query = OutboundNotification.query.filter(
+            OutboundNotification.status == 'pending',
+            OutboundNotification.service.in_(list(services)),
+            OutboundNotification.next_attempt_at <= datetime.datetime.now()
+        )
+        if exclude_ids:
+            query = query.filter(~OutboundNotification.id.in_(list(exclude_ids)))
+        return query.order_by(OutboundNotification.id).limit(limit).all()
+
+    def _bucket(self, service):
+        bucket = self.buckets.get(service)
+        if bucket is None:
+            bucket = self.buckets[service] = TokenBucket(1, 1)
+        return bucket
+
+    def _submit_due(self, in_flight):
+        """Send due messages while workers and rate limits allow; returns seconds until a throttled service frees up"""
+        free = self.max_workers * 2 - len(in_flight)
+        if free <= 0:
+            return None
+        # Only ask for services that can send right now
+        throttled = {service: bucket.seconds_until_available() for service, bucket in self.buckets.items()}
+        ready = [service for service, wait_seconds in throttled.items() if wait_seconds == 0]
+        items = self._claim(ready, [_message_id(item) for item in in_flight.values()], free) if ready else []
+
+        # Credentials are read when sending, so settings changes apply to queued messages
+        services = get_enabled_services() if items else {}
+        for item in items:
+            if not self._bucket(item.service).try_acquire():
+                continue
+            future = self._executor.submit(self._deliver, item.service, item.message, services.get(item.service))
+            in_flight[future] = item
+
+        waits = [wait_seconds for wait_seconds in throttled.values() if wait_seconds > 0]
+        if waits and self._has_due(throttled):
+            return min(waits)
+        return None
+
+    def _has_due(self, throttled):
+        """Return True when a throttled service has messages waiting"""
+        services = [service for service, wait_seconds in throttled.items() if wait_seconds > 0]
+        return self.db.session.query(
+            OutboundNotification.query.filter(
+                OutboundNotification.status == 'pending',
+                OutboundNotification.service.in_(services),
+                OutboundNotification.next_attempt_at <= datetime.datetime.now()
+            ).exists()
+        ).scalar()
+
+    def _backoff(self, attempts, retry_after=None):
+        """Return the delay before the next attempt, honouring the service's Retry-After"""
+        if retry_after is not None:
+            # A little jitter keeps retried messages from arriving in one burst
+            return retry_after + random.uniform(0, min(retry_after * 0.1, 1.0))
+        delay = min(self.retry_max_delay, self.retry_delay * (2 ** max(attempts - 1, 0)))
+        return random.uniform(delay / 2, delay)
+
+    def _dead_letter(self, item, result, now):
+        """Move a message that cannot be delivered to the dead-letter table"""
+        self.db.session.add(NotificationDeadLetter(
+            product_id=item.product_id,
+            size_id=item.size_id,
+            old_price=item.old_price,
+            new_price=item.new_price,
+            notification_type=item.notification_type,
+            service=item.service,
+            group_key=item.group_key,
+            details=item.details,
+            message=item.message,
+            attempts=item.attempts,
+            last_error=result.error,
+            status_code=result.status_code,
+            created_at=item.created_at,
+            failed_at=now
+        ))
+        self.db.session.delete(item)
+        self.dead_lettered += 1
+        logger.error(f"Moved {item.service} notification {item.id} to the dead-letter table after {item.attempts} attempts: {result.error}")
+
+    def _record(self, results):
+        """Write the outcome of finished deliveries in one transaction"""
+        now = datetime.datetime.now()
+        recorded = 0
+        # Messages about a product deleted while they were being sent are no longer queued
+        existing = {
+            item_id for (item_id,) in self.db.session.query(OutboundNotification.id)
+            .filter(OutboundNotification.id.in_([_message_id(item) for item, _ in results]))
+        }
+        for item, result in results:
+            if _message_id(item) not in existing:
+                self.db.session.expunge(item)
+                continue
+            if result.success:
+                # The history rows are the record of a delivery, so the message leaves the queue
+                self.db.session.delete(item)
+                # A coalesced message is recorded as one history row per size it covered
+                details = json.loads(item.details) if item.details else [{
+                    'product_id': item.product_id,
+                    'size_id': item.size_id,
+                    'old_price': item.old_price,
+                    'new_price': item.new_price,
+                    'notification_type': item.notification_type
+                }]
+                self.db.session.bulk_insert_mappings(NotificationHistory, [
+                    {
+                        'product_id': detail['product_id'],
+                        'size_id': detail['size_id'],
+                        'old_price': detail['old_price'],
+                        'new_price': detail['new_price'],
+                        'notification_type': detail['notification_type'],
+                        'sent_to': item.service,
+                        'timestamp': now
+                    }
+                    for detail in details
+                ])
+                recorded += len(details)
+                self.sent += 1
+                continue
+
+            item.last_error = result.error
+            if result.status_code == 429:
+                # Being rate limited is expected during bursts, so it does not use up an attempt
+                self.rate_limited += 1
+                self._bucket(item.service).pause(result.retry_after if result.retry_after is not None else self._backoff(1))
+            else:
+                item.attempts += 1
+
+            if not result.retryable or item.attempts >= self.max_attempts:
+                self._dead_letter(item, result, now)
+            else:
+                self.retried += 1
+                item.next_attempt_at = now + datetime.timedelta(seconds=self._backoff(item.attempts, result.retry_after))
+        try:
+            self.db.session.commit()
+            get_product_cache().add_notifications(recorded)
+            if recorded:
+                http_cache.bump(http_cache.NOTIFICATIONS)
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"Error recording {len(results)} notification results: {str(e)}")
+
+    def _deliver(self, service, message, config):
+        """Send one message (runs in a worker thread, without touching the database)"""
+        if config is None:
+            return DeliveryResult(False, error=f"{service} is not enabled")
+        try:
+            return send_notification(service, message, config)
+        except Exception as e:
+            return DeliveryResult(False, error=str(e), retryable=True)
+
+    def _run(self):
+        with self.app.app_context():
+            in_flight = self._in_flight = {}
+            while not self._stop_event.is_set():
+                try:
+                    self._wake_event.clear()
+                    throttle_wait = self._submit_due(in_flight)
+                    timeout = self.poll_interval if throttle_wait is None else min(self.poll_interval, throttle_wait)
+
+                    if not in_flight:
+                        with self._idle_lock:
+                            # A wake() since the claim means there may be new messages
+                            if throttle_wait is None and not self._wake_event.is_set():
+                                self._idle_event.set()
+                        self._wake_event.wait(timeout)
+                        continue
+
+                    done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+                    if done:
+                        self._record([(in_flight.pop(future), future.result()) for future in done])
+                except Exception as e:
+                    self.db.session.rollback()
+                    logger.error(f"Error in notification dispatcher: {str(e)}")
+                    time.sleep(1)
+            self.db.session.remove()
+
+    def stats(self):
+        """Return delivery statistics"""
+        counts = dict(
+            self.db.session.query(OutboundNotification.status, self.db.func.count(OutboundNotification.id))
+            .group_by(OutboundNotification.status)
+            .all()
+        )
+        return {
+            'workers': self.max_workers,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'sent': self.sent,
+            'retried': self.retried,
+            'rate_limited': self.rate_limited,
+            'dead_lettered': self.dead_lettered,
+            'queue': counts,
+            'dead_letters': NotificationDeadLetter.query.filter(NotificationDeadLetter.replayed_at.is_(None)).count(),
+            'throttled_seconds': {service: round(bucket.seconds_until_available(), 3) for service, bucket in self.buckets.items()}
+        }
+
+
+def replay_dead_letters(db, ids=None):
+    """Queue dead-lettered notifications for delivery again, returning how many were requeued"""
+    query = NotificationDeadLetter.query.filter(NotificationDeadLetter.replayed_at.is_(None))
+    if ids:
+        query = query.filter(NotificationDeadLetter.id.in_(ids))
+    letters = query.order_by(NotificationDeadLetter.id).all()
+    if not letters:
+        return 0
+
+    now = datetime.datetime.now()
+    for letter in letters:
+        db.session.add(OutboundNotification(
+            product_id=letter.product_id,
+            size_id=letter.size_id,
+            old_price=letter.old_price,
+            new_price=letter.new_price,
+            notification_type=letter.notification_type,
+            service=letter.service,
+            group_key=letter.group_key,
+            details=letter.details,
+            message=letter.message,
+            status='pending',
+            attempts=0,
+            created_at=letter.created_at or now,
+            next_attempt_at=now
+        ))
+        letter.replayed_at = now
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"Replaying {len(letters)} dead-lettered notifications")
+    if _dispatcher is not None:
+        _dispatcher.wake()
+    return len(letters)
+
+
+def delete_product_notifications(product_id):
+    """Delete the queued and dead-lettered messages about a deleted product (the caller commits)"""
+    # A digest also covers other products, so it is still sent
+    for model in (OutboundNotification, NotificationDeadLetter):
+        model.query.filter(
+            model.product_id == product_id,
+            model.group_key != "digest"
+        ).delete(synchronize_session=False)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def start_dispatcher(app, db):
+    """Start the process-wide notification dispatcher and return it"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher(app, db)
+        _dispatcher.start()
+        return _dispatcher
+
+
+def get_dispatcher():
+    """Return the process-wide notification dispatcher, or None before it is started"""
+    return _dispatcher
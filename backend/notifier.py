@@ -1,16 +1,120 @@
 import os
 import logging
 import json
+import time
+import threading
 import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from linebot import LineBotApi
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+from http_client import get_session
 from linebot.models import TextSendMessage
 from linebot.exceptions import LineBotApiError
 
 # Configure logging
 logger = logging.getLogger("snidan_notifier")
 
+# API endpoints (can be overridden in .env, e.g. to point at a local stand-in)
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", LineBotApi.DEFAULT_API_ENDPOINT)
+CHATWORK_API_BASE = os.getenv("CHATWORK_API_BASE", "https://api.chatwork.com/v2")
+# Seconds to wait for a service before giving up on a message
+NOTIFY_TIMEOUT = float(os.getenv("NOTIFY_TIMEOUT", "10"))
+
+
+class PooledLineHttpClient(RequestsHttpClient):
+    """LINE SDK HTTP client that sends through the shared keep-alive session"""
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return RequestsHttpResponse(get_session("line").get(
+            url, headers=headers, params=params, stream=stream, timeout=timeout or self.timeout
+        ))
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return RequestsHttpResponse(get_session("line").post(
+            url, headers=headers, data=data, timeout=timeout or self.timeout
+        ))
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return RequestsHttpResponse(get_session("line").delete(
+            url, headers=headers, data=data, timeout=timeout or self.timeout
+        ))
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return RequestsHttpResponse(get_session("line").put(
+            url, headers=headers, data=data, timeout=timeout or self.timeout
+        ))
+
+
+# LINE API clients, one per channel access token
+_line_clients = {}
+_line_clients_lock = threading.Lock()
+
+
+def get_line_client(token):
+    """Return the cached LINE API client for a channel access token"""
+    with _line_clients_lock:
+        client = _line_clients.get(token)
+        if client is None:
+            client = LineBotApi(token, endpoint=LINE_API_ENDPOINT, timeout=NOTIFY_TIMEOUT, http_client=PooledLineHttpClient)
+            _line_clients[token] = client
+        return client
+
+
+def reset_clients():
+    """Forget the cached clients, e.g. after the credentials have changed"""
+    with _line_clients_lock:
+        _line_clients.clear()
+
+class DeliveryResult:
+    """Outcome of one delivery attempt; truthy when the service accepted the message"""
+
+    def __init__(self, success, status_code=None, retry_after=None, error=None, retryable=False):
+        self.success = success
+        self.status_code = status_code
+        # Seconds the service asked us to wait before trying again
+        self.retry_after = retry_after
+        self.error = error
+        self.retryable = retryable
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        return f"<DeliveryResult success={self.success} status={self.status_code} retry_after={self.retry_after}>"
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds, or None"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(status_code):
+    """Rate limits and server errors are worth retrying; other client errors are not"""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def _failed_response(service, response, retry_after=None):
+    """Build the DeliveryResult of a rejected HTTP response"""
+    if retry_after is None:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    error = f"{response.status_code} {response.text[:200]}"
+    logger.error(f"Error sending {service} notification: {error}")
+    return DeliveryResult(False, response.status_code, retry_after, error, _is_retryable(response.status_code))
+
+
 def send_notification(service, message, config):
-    """Send notification using the specified service"""
+    """Send notification using the specified service, returning a DeliveryResult"""
     if service == "line":
         return send_line_notification(message, config)
     elif service == "discord":
@@ -19,7 +123,7 @@ def send_notification(service, message, config):
         return send_chatwork_notification(message, config)
     else:
         logger.error(f"Unknown notification service: {service}")
-        return False
+        return DeliveryResult(False, error=f"Unknown notification service: {service}")
 
 def send_line_notification(message, config):
     """Send notification via LINE"""
@@ -29,21 +133,22 @@ def send_line_notification(message, config):
         
         if not token or not user_id:
             logger.error("LINE token or user ID not provided")
-            return False
+            return DeliveryResult(False, error="LINE token or user ID not provided")
         
-        line_bot_api = LineBotApi(token)
+        line_bot_api = get_line_client(token)
         line_bot_api.push_message(user_id, TextSendMessage(text=message))
         
         logger.info("LINE notification sent successfully")
-        return True
+        return DeliveryResult(True, 200)
     
     except LineBotApiError as e:
         logger.error(f"Error sending LINE notification: {str(e)}")
-        return False
+        retry_after = parse_retry_after((e.headers or {}).get("Retry-After"))
+        return DeliveryResult(False, e.status_code, retry_after, str(e), _is_retryable(e.status_code))
     
     except Exception as e:
         logger.error(f"Unexpected error sending LINE notification: {str(e)}")
-        return False
+        return DeliveryResult(False, error=str(e), retryable=True)
 
 def send_discord_notification(message, config):
     """Send notification via Discord webhook"""
@@ -52,29 +157,36 @@ def send_discord_notification(message, config):
         
         if not webhook_url:
             logger.error("Discord webhook URL not provided")
-            return False
+            return DeliveryResult(False, error="Discord webhook URL not provided")
         
         data = {
             "content": message,
             "username": "スニダン価格監視"
         }
         
-        response = requests.post(
+        response = get_session("discord").post(
             webhook_url,
             data=json.dumps(data),
-            headers={"Content-Type": "application/json"}
+            headers={"Content-Type": "application/json"},
+            timeout=NOTIFY_TIMEOUT
         )
         
-        if response.status_code == 204:
+        if 200 <= response.status_code < 300:
             logger.info("Discord notification sent successfully")
-            return True
-        else:
-            logger.error(f"Error sending Discord notification: {response.status_code} {response.text}")
-            return False
+            return DeliveryResult(True, response.status_code)
+        
+        retry_after = None
+        if response.status_code == 429:
+            # Discord puts the precise wait in the body as well as the header
+            try:
+                retry_after = float(response.json().get("retry_after"))
+            except (ValueError, TypeError, AttributeError):
+                retry_after = None
+        return _failed_response("Discord", response, retry_after)
     
     except Exception as e:
         logger.error(f"Error sending Discord notification: {str(e)}")
-        return False
+        return DeliveryResult(False, error=str(e), retryable=True)
 
 def send_chatwork_notification(message, config):
     """Send notification via Chatwork"""
@@ -84,7 +196,7 @@ def send_chatwork_notification(message, config):
         
         if not token or not room_id:
             logger.error("Chatwork token or room ID not provided")
-            return False
+            return DeliveryResult(False, error="Chatwork token or room ID not provided")
         
         headers = {
             "X-ChatWorkToken": token,
@@ -95,19 +207,25 @@ def send_chatwork_notification(message, config):
             "body": message
         }
         
-        response = requests.post(
-            f"https://api.chatwork.com/v2/rooms/{room_id}/messages",
+        response = get_session("chatwork").post(
+            f"{CHATWORK_API_BASE}/rooms/{room_id}/messages",
             headers=headers,
-            data=data
+            data=data,
+            timeout=NOTIFY_TIMEOUT
         )
         
         if response.status_code == 200:
             logger.info("Chatwork notification sent successfully")
-            return True
-        else:
-            logger.error(f"Error sending Chatwork notification: {response.status_code} {response.text}")
-            return False
+            return DeliveryResult(True, response.status_code)
+        
+        retry_after = None
+        if response.status_code == 429:
+            # Chatwork reports when its 5 minute window resets
+            reset_at = response.headers.get("x-ratelimit-reset")
+            if reset_at and reset_at.isdigit():
+                retry_after = max(int(reset_at) - time.time(), 0.0)
+        return _failed_response("Chatwork", response, retry_after)
     
     except Exception as e:
         logger.error(f"Error sending Chatwork notification: {str(e)}")
-        return False 
\ No newline at end of file
+        return DeliveryResult(False, error=str(e), retryable=True)
@@ -0,0 +1,54 @@
+import json
+import base64
+import datetime
+
+# Page sizes for the list APIs
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Parse a `limit` query parameter, clamped to 1..maximum"""
+    if value in (None, ''):
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, maximum)
+
+
+def encode_cursor(timestamp, row_id):
+    """Encode the (timestamp, id) of the last row of a page as an opaque cursor"""
+    payload = json.dumps([timestamp.isoformat() if timestamp else None, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor() back into (timestamp, id); raises ValueError when malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except Exception:
+        raise ValueError(f"invalid cursor: {cursor}")
+
+
+def keyset_page(query, timestamp_column, id_column, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return (rows, next_cursor) for a query paged newest first on (timestamp, id).
+
+    The rows must expose `timestamp` and `id`. Pages are fetched by seeking
+    past the cursor rather than with OFFSET, so every page costs the same
+    index range scan however deep it is.
+    """
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        # The plain `<=` bound is what lets SQLite turn the seek into an index range
+        query = query.filter(
+            timestamp_column <= timestamp,
+            (timestamp_column < timestamp) | (id_column < row_id)
+        )
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
@@ -0,0 +1,102 @@
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from scraper import get_current_prices
+
+# Configure logging
+logger = logging.getLogger("snidan_poller")
+
+# Polling settings (can be overridden in .env)
+DEFAULT_WORKERS = int(os.getenv("MONITOR_WORKERS", "16"))
+DEFAULT_PER_HOST_LIMIT = int(os.getenv("MONITOR_PER_HOST_LIMIT", "8"))
+DEFAULT_SWEEP_DEADLINE = float(os.getenv("MONITOR_SWEEP_DEADLINE", "300"))
+
+# Plain snapshot of a product so worker threads never touch the SQLAlchemy session
+ProductTarget = namedtuple("ProductTarget", ["id", "name", "url"])
+
+# Outcome of a single fetch: prices is None when nothing could be retrieved
+FetchResult = namedtuple("FetchResult", ["target", "prices", "elapsed", "error"])
+
+
+class PricePoller:
+    """Fetch current prices for many products with bounded concurrency"""
+
+    def __init__(self, max_workers=None, per_host_limit=None, sweep_deadline=None):
+        self.max_workers = max(1, max_workers or DEFAULT_WORKERS)
+        self.per_host_limit = max(1, per_host_limit or DEFAULT_PER_HOST_LIMIT)
+        self.sweep_deadline = sweep_deadline or DEFAULT_SWEEP_DEADLINE
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+        self._futures = set()  # Fetches of the current sweep, cancelled on shutdown
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="price-poller")
+
+    def _host_semaphore(self, url):
+        """Return the semaphore limiting concurrent requests to the URL's host"""
+        host = urlparse(url).netloc
+        with self._host_lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def _fetch(self, driver, target, deadline, stop_event):
+        """Fetch prices for one product (runs in a worker thread)"""
+        started = time.monotonic()
+        semaphore = self._host_semaphore(target.url)
+        # Wait for a host slot, but give up once the sweep deadline has passed
+        while not semaphore.acquire(timeout=0.5):
+            if time.monotonic() >= deadline or (stop_event and stop_event.is_set()):
+                return FetchResult(target, None, time.monotonic() - started, "deadline")
+        try:
+            if time.monotonic() >= deadline or (stop_event and stop_event.is_set()):
+                return FetchResult(target, None, time.monotonic() - started, "deadline")
+            prices = get_current_prices(driver, target, conditional=True)
+            return FetchResult(target, prices, time.monotonic() - started, None)
+        except Exception as e:
+            return FetchResult(target, None, time.monotonic() - started, str(e))
+        finally:
+            semaphore.release()
+
+    def poll(self, targets, driver=None, stop_event=None):
+        """Fetch prices for all targets, yielding results as they complete.
+
+        Fetches that have not finished when the sweep deadline expires are
+        cancelled and reported with error "deadline".
+        """
+        deadline = time.monotonic() + self.sweep_deadline
+        futures = {
+            self._executor.submit(self._fetch, driver, target, deadline, stop_event): target
+            for target in targets
+        }
+        pending = set(futures)
+        self._futures = set(futures)
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (stop_event and stop_event.is_set()):
+                break
+            done, pending = wait(pending, timeout=min(remaining, 1.0), return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+        for future in pending:
+            if future.done() and not future.cancelled():
+                yield future.result()
+                continue
+            future.cancel()
+            yield FetchResult(futures[future], None, None, "deadline")
+
+        if pending:
+            logger.warning(f"Sweep deadline of {self.sweep_deadline}s reached, {len(pending)} products not fetched")
+
+    def shutdown(self):
+        """Stop the worker threads"""
+        # Cancelled by hand: shutdown(cancel_futures=True) needs Python 3.9
+        for future in list(self._futures):
+            future.cancel()
+        self._executor.shutdown(wait=False)
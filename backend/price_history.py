@@ -0,0 +1,255 @@
+import os
+import re
+import datetime
+import itertools
+import numpy as np
+from sqlalchemy import func, cast, Integer
+from models import Size, PriceHistory, PriceRollup
+from price_rollups import HOURLY, DAILY
+
+# Chart settings (can be overridden in .env)
+DEFAULT_POINTS = int(os.getenv("HISTORY_DEFAULT_POINTS", "500"))
+MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "5000"))
+
+# Bucket widths that "auto" resolution picks from, in seconds
+BUCKET_STEPS = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 7 * 86400, 30 * 86400)
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+MODES = ('ohlc', 'lttb')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def parse_resolution(value):
+    """Parse a bucket width such as "15m", "1h", "1d" or a number of seconds; None or "auto" picks one"""
+    if not value or value == 'auto':
+        return None
+    match = re.fullmatch(r'(\d+)([smhdw]?)', value.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"invalid resolution: {value}")
+    return int(match.group(1)) * UNITS[match.group(2) or 's']
+
+
+def parse_time(value):
+    """Parse an ISO 8601 `from`/`to` parameter into the naive local time history is stored in.
+
+    Values with an offset (or a trailing Z) are converted to local time.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith(('Z', 'z')) else value)
+    except ValueError:
+        raise ValueError(f"invalid time: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def bucket_width(span, points, resolution=None):
+    """Return the bucket width in seconds, never so narrow that more than `points` aligned buckets cover `span`"""
+    # A span touches at most span // width + 1 buckets aligned to multiples of the width
+    minimum = max(1, -(-(int(span) + 1) // max(points - 1, 1)))
+    if resolution and resolution >= minimum:
+        return resolution
+    for step in BUCKET_STEPS:
+        if step >= minimum:
+            return step
+    return -(-minimum // 86400) * 86400
+
+
+def _epoch(timestamp):
+    """Seconds since the epoch of a naive timestamp, read as UTC like SQLite's strftime('%s') reads the stored ones"""
+    return int((timestamp - EPOCH).total_seconds())
+
+
+def to_iso(seconds):
+    """Format epoch seconds as ISO 8601 timestamps"""
+    return [(EPOCH + datetime.timedelta(seconds=int(value))).isoformat() for value in seconds]
+
+
+def _ohlc_columns(bucket_starts, opens, highs, lows, closes, counts):
+    return {
+        't': to_iso(bucket_starts),
+        'open': opens.tolist(),
+        'high': highs.tolist(),
+        'low': lows.tolist(),
+        'close': closes.tolist(),
+        'count': counts.tolist()
+    }
+
+
+def _bucket_bounds(seconds, width):
+    """Return (bucket numbers, first index, last index) of the runs of samples sharing a bucket"""
+    buckets = seconds // width
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(seconds)] - 1
+    return buckets, starts, ends
+
+
+def ohlc(seconds, prices, width):
+    """Aggregate a price series (sorted by time) into OHLC buckets aligned to multiples of `width`.
+
+    History rows are only written when the price changes, so the price in
+    effect when a bucket starts is the close of the row before it; it is
+    the bucket's open and counts towards its high and low.
+    """
+    buckets, starts, ends = _bucket_bounds(seconds, width)
+    opens = np.r_[prices[0], prices[starts[1:] - 1]]
+    highs = np.maximum(np.maximum.reduceat(prices, starts), opens)
+    lows = np.minimum(np.minimum.reduceat(prices, starts), opens)
+    return _ohlc_columns(buckets[starts] * width, opens, highs, lows, prices[ends], ends - starts + 1)
+
+
+def merge_ohlc(seconds, opens, highs, lows, closes, counts, width):
+    """Merge OHLC buckets (sorted by start) into wider buckets aligned to multiples of `width`"""
+    buckets, starts, ends = _bucket_bounds(seconds, width)
+    return _ohlc_columns(
+        buckets[starts] * width, opens[starts], np.maximum.reduceat(highs, starts),
+        np.minimum.reduceat(lows, starts), closes[ends], np.add.reduceat(counts, starts)
+    )
+
+
+def lttb(seconds, prices, points):
+    """Pick `points` samples with Largest-Triangle-Three-Buckets, keeping the visual shape of the series"""
+    count = len(prices)
+    if count <= points or points < 3:
+        return {'t': to_iso(seconds), 'price': prices.tolist()}
+
+    x = seconds.astype(np.float64)
+    y = prices.astype(np.float64)
+    # Every point but the first and last falls into one of points - 2 buckets
+    edges = np.linspace(1, count - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else count
+        # The next bucket is represented by its average point
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return {'t': to_iso(seconds[selected]), 'price': prices[selected].tolist()}
+
+
+def _product_size_ids(db, product_id):
+    return db.session.query(Size.id).filter(Size.product_id == product_id).scalar_subquery()
+
+
+def load_by_size(db, statement, columns):
+    """Run a statement whose rows are (size_id, *columns integers) sorted by size, into {size_id: [column arrays]}"""
+    # Executed on the connection as a Core statement, without the ORM's per-row bookkeeping
+    rows = db.session.connection().execute(statement).all()
+    if not rows:
+        return {}
+
+    values = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=(columns + 1) * len(rows))
+    size_ids, *arrays = values.reshape(-1, columns + 1).T
+    starts = np.flatnonzero(np.r_[True, size_ids[1:] != size_ids[:-1]])
+    return {
+        int(size_ids[first]): [array[first:last] for array in arrays]
+        for first, last in zip(starts, np.r_[starts[1:], len(size_ids)])
+    }
+
+
+def _split_by_size(db, statement, sizes, columns):
+    """Return {size_id: (label, arrays)} for every size in `sizes`, with empty arrays for sizes without rows"""
+    series = {size_id: (label, [np.empty(0, dtype=np.int64)] * columns) for size_id, label in sizes.items()}
+    for size_id, arrays in load_by_size(db, statement, columns).items():
+        series[size_id] = (sizes.get(size_id), arrays)
+    return series
+
+
+def load_series(db, product_id, start=None, end=None):
+    """Return {size_id: (size label, [seconds, prices])} for every size of a product, read in one indexed query"""
+    sizes = dict(db.session.query(Size.id, Size.size).filter(Size.product_id == product_id).order_by(Size.id).all())
+
+    # Epoch seconds are computed by SQLite, which is much cheaper than building a datetime per row
+    epoch = cast(func.strftime('%s', PriceHistory.timestamp), Integer)
+    query = db.session.query(PriceHistory.size_id, epoch, PriceHistory.price).filter(
+        PriceHistory.size_id.in_(_product_size_ids(db, product_id))
+    )
+    if start is not None:
+        query = query.filter(PriceHistory.timestamp >= start)
+    if end is not None:
+        query = query.filter(PriceHistory.timestamp <= end)
+    return _split_by_size(db, query.order_by(PriceHistory.size_id, PriceHistory.timestamp).statement, sizes, 2)
+
+
+def load_rollups(db, product_id, period, start=None, end=None):
+    """Return {size_id: (size label, [bucket starts, opens, highs, lows, closes, counts])} from the rollup table.
+
+    The range snaps outwards to whole buckets of the period.
+    """
+    sizes = dict(db.session.query(Size.id, Size.size).filter(Size.product_id == product_id).order_by(Size.id).all())
+
+    query = db.session.query(
+        PriceRollup.size_id, PriceRollup.bucket_start, PriceRollup.open_price, PriceRollup.high_price,
+        PriceRollup.low_price, PriceRollup.close_price, PriceRollup.change_count
+    ).filter(PriceRollup.size_id.in_(_product_size_ids(db, product_id)), PriceRollup.period == period)
+    if start is not None:
+        query = query.filter(PriceRollup.bucket_start >= _epoch(start) // period * period)
+    if end is not None:
+        query = query.filter(PriceRollup.bucket_start <= _epoch(end))
+    return _split_by_size(db, query.order_by(PriceRollup.size_id, PriceRollup.bucket_start).statement, sizes, 6)
+
+
+def history_extent(db, product_id):
+    """Return (first, last) epoch seconds covered by a product's daily rollups, or (None, None)"""
+    return db.session.query(
+        func.min(PriceRollup.bucket_start), func.max(PriceRollup.bucket_start + PriceRollup.period)
+    ).filter(PriceRollup.size_id.in_(_product_size_ids(db, product_id)), PriceRollup.period == DAILY).one()
+
+
+def product_history(db, product_id, start=None, end=None, resolution=None, points=None, mode='ohlc'):
+    """Return the downsampled price history of every size of a product, at most `points` entries per size.
+
+    OHLC buckets that are whole hours are merged from the hourly or daily
+    rollups, so long ranges cost one row per rollup bucket rather than one
+    per raw sample; narrower buckets and LTTB read the raw history.
+    """
+    if mode not in MODES:
+        raise ValueError(f"invalid mode: {mode}")
+    points = min(points or DEFAULT_POINTS, MAX_POINTS)
+
+    width = None
+    source = 'raw'
+    if mode == 'ohlc':
+        first, last = (_epoch(start) if start else None), (_epoch(end) if end else None)
+        if first is None or last is None:
+            extent = history_extent(db, product_id)
+            first = first if first is not None else extent[0] or 0
+            last = last if last is not None else extent[1] or 0
+        width = bucket_width(max(last - first, 1), points, resolution)
+        if width % HOURLY == 0:
+            source = 'daily' if width % DAILY == 0 else 'hourly'
+
+    sizes = []
+    if source == 'raw':
+        for size_id, (label, (seconds, prices)) in load_series(db, product_id, start, end).items():
+            entry = {'size_id': size_id, 'size': label, 'samples': len(prices)}
+            if len(prices):
+                entry.update(ohlc(seconds, prices, width) if mode == 'ohlc' else lttb(seconds, prices, points))
+            sizes.append(entry)
+    else:
+        period = DAILY if source == 'daily' else HOURLY
+        for size_id, (label, columns) in load_rollups(db, product_id, period, start, end).items():
+            entry = {'size_id': size_id, 'size': label, 'samples': int(columns[5].sum())}
+            if len(columns[0]):
+                entry.update(merge_ohlc(*columns, width))
+            sizes.append(entry)
+    return {
+        'product_id': product_id,
+        'from': start.isoformat() if start else None,
+        'to': end.isoformat() if end else None,
+        'mode': mode,
+        'resolution': width,
+        'source': source,
+        'sizes': sizes
+    }
@@ -0,0 +1,140 @@
+import os
+import datetime
+import numpy as np
+from sqlalchemy import func, cast, Integer
+from models import Size, PriceInterval
+import price_history
+
+# Interval settings (can be overridden in .env)
+# A poll more than this many seconds after the last one starts a new interval even when
+# the price is unchanged, so the time in between reads as "not polled"
+MAX_GAP = float(os.getenv("HISTORY_INTERVAL_MAX_GAP", "3600"))
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Builds intervals from change-only price history: each change is assumed to hold
+# until the next one, and the last until its product was last checked
+BACKFILL_SQL = """
+INSERT INTO price_intervals (size_id, price, valid_from, valid_to)
+SELECT h.size_id, h.price, h.timestamp,
+       COALESCE(LEAD(h.timestamp) OVER (PARTITION BY h.size_id ORDER BY h.timestamp, h.id),
+                MAX(COALESCE(p.last_checked, h.timestamp), h.timestamp))
+FROM price_history h
+JOIN sizes s ON s.id = h.size_id
+JOIN products p ON p.id = s.product_id
+WHERE h.price IS NOT NULL AND h.timestamp IS NOT NULL
+ORDER BY h.size_id, h.timestamp, h.id
+"""
+
+
+def record(session, observed, unchanged, max_gap=None):
+    """Extend or open price intervals for one batch of polls, in the caller's transaction.
+
+    `observed` is a list of (size_id, price, checked_at) for sizes whose
+    price was read; `unchanged` a list of (product_id, checked_at) for
+    products whose response showed no change at all.
+    """
+    if not observed and not unchanged:
+        return
+    max_gap = datetime.timedelta(seconds=max_gap if max_gap is not None else MAX_GAP)
+    size_ids = [size_id for size_id, _, _ in observed]
+    unchanged_at = dict(unchanged)
+
+    # The newest interval of every size in the batch, in one query
+    latest = session.query(func.max(PriceInterval.id)).join(Size, Size.id == PriceInterval.size_id)
+    latest = latest.filter(Size.id.in_(size_ids) | Size.product_id.in_(list(unchanged_at))).group_by(PriceInterval.size_id)
+    heads = {
+        row.size_id: row for row in
+        session.query(PriceInterval.id, PriceInterval.size_id, Size.product_id, PriceInterval.price, PriceInterval.valid_to)
+        .join(Size, Size.id == PriceInterval.size_id)
+        .filter(PriceInterval.id.in_(latest.scalar_subquery()))
+        .all()
+    }
+
+    observations = list(observed) + [
+        (head.size_id, head.price, unchanged_at[head.product_id])
+        for head in heads.values() if head.product_id in unchanged_at
+    ]
+
+    extended = []
+    opened = []
+    for size_id, price, checked_at in observations:
+        head = heads.get(size_id)
+        if head is not None and head.price == price and head.valid_to <= checked_at <= head.valid_to + max_gap:
+            extended.append({'id': head.id, 'valid_to': checked_at})
+        elif head is None or checked_at > head.valid_to:
+            opened.append({'size_id': size_id, 'price': price, 'valid_from': checked_at, 'valid_to': checked_at})
+
+    if extended:
+        session.bulk_update_mappings(PriceInterval, extended)
+    if opened:
+        session.bulk_insert_mappings(PriceInterval, opened)
+
+
+def backfill(connection):
+    """Build the intervals of existing price history on a sqlite3 connection"""
+    connection.execute(BACKFILL_SQL)
+
+
+def _epoch(timestamp):
+    return int((timestamp - EPOCH).total_seconds())
+
+
+def load(db, size_ids, start=None, end=None):
+    """Return {size_id: (valid_from, valid_to, prices)} epoch-second arrays of the intervals overlapping a range"""
+    valid_from = cast(func.strftime('%s', PriceInterval.valid_from), Integer)
+    valid_to = cast(func.strftime('%s', PriceInterval.valid_to), Integer)
+    query = db.session.query(PriceInterval.size_id, valid_from, valid_to, PriceInterval.price).filter(PriceInterval.size_id.in_(size_ids))
+    if start is not None:
+        # One interval further back carries the price in effect when the range starts
+        query = query.filter(PriceInterval.valid_to >= start - datetime.timedelta(seconds=MAX_GAP))
+    if end is not None:
+        query = query.filter(PriceInterval.valid_from <= end)
+    statement = query.order_by(PriceInterval.size_id, PriceInterval.valid_from).statement
+
+    series = {size_id: (np.empty(0, dtype=np.int64),) * 3 for size_id in size_ids}
+    for size_id, arrays in price_history.load_by_size(db, statement, 3).items():
+        series[size_id] = tuple(arrays)
+    return series
+
+
+def sample(valid_from, valid_to, prices, grid, max_gap=None):
+    """Return the price in effect at each grid time (epoch seconds), or None where the size was not being polled.
+
+    Between two intervals polled less than max_gap apart the earlier price
+    holds until the later interval starts.
+    """
+    max_gap = max_gap if max_gap is not None else MAX_GAP
+    if not len(prices):
+        return [None] * len(grid)
+    next_from = np.r_[valid_from[1:], valid_to[-1]]
+    ends = np.where(next_from - valid_to <= max_gap, np.maximum(next_from, valid_to), valid_to)
+    index = np.searchsorted(valid_from, grid, side='right') - 1
+    clipped = np.maximum(index, 0)
+    covered = (index >= 0) & (grid <= ends[clipped])
+    return [int(price) if ok else None for price, ok in zip(prices[clipped], covered)]
+
+
+def coverage(valid_from, valid_to, start, end, max_gap=None):
+    """Fraction of [start, end] (epoch seconds) in which the size was being polled"""
+    max_gap = max_gap if max_gap is not None else MAX_GAP
+    if end <= start or not len(valid_from):
+        return 0.0
+    next_from = np.r_[valid_from[1:], valid_to[-1]]
+    ends = np.where(next_from - valid_to <= max_gap, np.maximum(next_from, valid_to), valid_to)
+    observed = np.clip(ends, start, end) - np.clip(valid_from, start, end)
+    return round(float(observed.sum()) / (end - start), 4)
+
+
+def series(db, size_ids, start, end, width):
+    """Reconstruct the price series of several sizes on one shared grid of `width` seconds"""
+    first = _epoch(start)
+    grid = np.arange(first - first % width, _epoch(end) + 1, width, dtype=np.int64)
+    intervals = load(db, size_ids, start, end)
+    return grid, {
+        size_id: {
+            'price': sample(valid_from, valid_to, prices, grid),
+            'coverage': coverage(valid_from, valid_to, _epoch(start), _epoch(end))
+        }
+        for size_id, (valid_from, valid_to, prices) in intervals.items()
+    }
@@ -0,0 +1,129 @@
+import sys
+import time
+import calendar
+import logging
+import sqlite3
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import PriceRollup
+
+# Configure logging
+logger = logging.getLogger("snidan_rollups")
+
+HOURLY = 3600
+DAILY = 86400
+PERIODS = (HOURLY, DAILY)
+
+# Rebuilds the rollups of one period from price_history. Like the incremental path,
+# a bucket opens at the price carried in from the previous row (history only
+# records changes), and that price counts towards the bucket's high and low.
+BACKFILL_SQL = """
+INSERT OR REPLACE INTO price_rollups
+    (size_id, period, bucket_start, open_price, high_price, low_price, close_price, change_count)
+WITH ordered AS (
+    SELECT size_id, id, timestamp, price,
+           CAST(strftime('%s', timestamp) AS INTEGER) / :period * :period AS bucket,
+           COALESCE(LAG(price) OVER (PARTITION BY size_id ORDER BY timestamp, id), price) AS carried
+    FROM price_history
+    WHERE price IS NOT NULL {size_filter}
+),
+marked AS (
+    SELECT size_id, bucket, price,
+           FIRST_VALUE(carried) OVER bucket_rows AS open_price,
+           LAST_VALUE(price) OVER bucket_rows AS close_price
+    FROM ordered
+    WINDOW bucket_rows AS (PARTITION BY size_id, bucket ORDER BY timestamp, id
+                           ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+)
+SELECT size_id, :period, bucket,
+       MAX(open_price), MAX(MAX(price), MAX(open_price)), MIN(MIN(price), MIN(open_price)), MAX(close_price), COUNT(*)
+FROM marked
+WHERE bucket >= :since
+GROUP BY size_id, bucket
+"""
+
+
+def bucket_start(timestamp, period):
+    """Start of the bucket holding a naive UTC datetime, in epoch seconds"""
+    seconds = calendar.timegm(timestamp.timetuple())
+    return seconds - seconds % period
+
+
+def record(session, rows):
+    """Fold newly written history rows into the rollups, in the caller's transaction.
+
+    `rows` are dicts with size_id, timestamp, price and old_price (the price
+    before the change, None for the first observation), later than anything
+    already rolled up.
+    """
+    buckets = {}
+    for row in sorted(rows, key=lambda row: row['timestamp']):
+        price = row['price']
+        if price is None:
+            continue
+        for period in PERIODS:
+            key = (row['size_id'], period, bucket_start(row['timestamp'], period))
+            bucket = buckets.get(key)
+            if bucket is None:
+                open_price = row.get('old_price') if row.get('old_price') is not None else price
+                bucket = buckets[key] = {
+                    'size_id': key[0], 'period': period, 'bucket_start': key[2],
+                    'open_price': open_price, 'high_price': max(open_price, price), 'low_price': min(open_price, price),
+                    'close_price': price, 'change_count': 0
+                }
+            bucket['high_price'] = max(bucket['high_price'], price)
+            bucket['low_price'] = min(bucket['low_price'], price)
+            bucket['close_price'] = price
+            bucket['change_count'] += 1
+    if not buckets:
+        return
+
+    values = list(buckets.values())
+    table = PriceRollup.__table__
+    for start in range(0, len(values), 1000):
+        statement = sqlite_insert(table).values(values[start:start + 1000])
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(
+            index_elements=['size_id', 'period', 'bucket_start'],
+            set_={
+                # SQLite's two-argument max()/min() are scalar functions
+                'high_price': func.max(table.c.high_price, excluded.high_price),
+                'low_price': func.min(table.c.low_price, excluded.low_price),
+                'close_price': excluded.close_price,
+                'change_count': table.c.change_count + excluded.change_count
+            }
+        )
+        session.execute(statement)
+
+
+def backfill(connection, size_ids=None, since=None):
+    """Rebuild the rollups from price_history on a sqlite3 connection.
+
+    Only buckets starting at or after `since` (a datetime) are rebuilt, so
+    the rollups of history that retention has archived are kept. All sizes
+    are rebuilt unless size_ids are given.
+    """
+    size_filter = ''
+    if size_ids is not None:
+        size_ids = [int(size_id) for size_id in size_ids]
+        if not size_ids:
+            return
+        size_filter = f"AND size_id IN ({', '.join(str(size_id) for size_id in size_ids)})"
+    for period in PERIODS:
+        started = time.monotonic()
+        params = {'period': period, 'since': bucket_start(since, period) if since else 0}
+        connection.execute(f"DELETE FROM price_rollups WHERE period = :period AND bucket_start >= :since {size_filter}", params)
+        connection.execute(BACKFILL_SQL.format(size_filter=size_filter), params)
+        logger.info(f"Backfilled {period}s price rollups in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    # python price_rollups.py [database path]: rebuild the rollups of the raw history still kept
+    from setup import db_path
+    from retention import raw_horizon
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else db_path)
+    try:
+        backfill(conn, since=raw_horizon())
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+from collections import deque
+
+# Configure logging
+logger = logging.getLogger("snidan_price_stream")
+
+# Stream settings (can be overridden in .env)
+# Changes kept for clients that reconnect or fall behind; a client further back than this is reset
+BUFFER_SIZE = int(os.getenv("PRICE_STREAM_BUFFER", "5000"))
+MAX_CLIENTS = int(os.getenv("PRICE_STREAM_MAX_CLIENTS", "50"))
+# Seconds between keep-alive comments, which also detect disconnected clients
+HEARTBEAT = float(os.getenv("PRICE_STREAM_HEARTBEAT", "15"))
+# Most events written to a client at once while it catches up
+MAX_BATCH = int(os.getenv("PRICE_STREAM_MAX_BATCH", "500"))
+RETRY_MS = 3000
+
+
+class StreamFull(Exception):
+    """Raised when MAX_CLIENTS clients are already subscribed"""
+
+
+class PriceStream:
+    """Fan out committed price changes to Server-Sent Events clients.
+
+    Each change is serialized once, when the monitor publishes it, into a
+    bounded ring buffer that every client reads from with its own cursor,
+    so the cost grows with the number of changes rather than with the
+    catalog. A slow client only falls behind: it is never given a queue of
+    its own, and when its cursor drops out of the buffer it is sent a
+    `reset` event telling it to reload instead.
+
+    Event ids are "<stream>-<sequence>"; the stream part changes on every
+    start, so a client resuming across a restart is reset as well.
+    """
+
+    def __init__(self, buffer_size=None, max_clients=None, heartbeat=None, max_batch=None):
+        self.stream_id = format(int(time.time()), 'x')
+        self.max_clients = max_clients or MAX_CLIENTS
+        self.heartbeat = heartbeat or HEARTBEAT
+        self.max_batch = max(1, max_batch or MAX_BATCH)
+        self.clients = 0
+        self.published = 0
+        self.resets = 0
+        self._sequence = 0
+        self._events = deque(maxlen=max(1, buffer_size or BUFFER_SIZE))  # (sequence, SSE message)
+        self._condition = threading.Condition()
+
+    def event_id(self, sequence):
+        return f"{self.stream_id}-{sequence}"
+
+    def publish(self, changes):
+        """Append committed PriceChange tuples to the stream and wake the waiting clients"""
+        if not changes:
+            return
+        messages = [
+            json.dumps({
+                'product_id': change.product_id,
+                'size': change.size,
+                'old': change.old_price,
+                'new': change.new_price,
+                'ts': change.timestamp.isoformat() if change.timestamp else None
+            }, ensure_ascii=False, separators=(',', ':'))
+            for change in changes
+        ]
+        with self._condition:
+            for data in messages:
+                self._sequence += 1
+                self._events.append((self._sequence, f"id: {self.event_id(self._sequence)}\nevent: price\ndata: {data}\n\n"))
+            self.published += len(messages)
+            self._condition.notify_all()
+
+    def _resume_from(self, last_event_id):
+        """Return the sequence a client has seen up to, or None when it cannot resume from this buffer"""
+        if not last_event_id:
+            return self._sequence
+        stream_id, _, sequence = last_event_id.partition('-')
+        if stream_id != self.stream_id or not sequence.isdigit() or int(sequence) > self._sequence:
+            return None
+        return int(sequence)
+
+    def _read(self, cursor):
+        """Return (messages after the cursor, new cursor, whether the cursor fell out of the buffer)"""
+        oldest = self._events[0][0] if self._events else self._sequence + 1
+        if cursor is None or cursor < oldest - 1:
+            return [], self._sequence, True
+        start = cursor - oldest + 1
+        batch = [message for _, message in itertools.islice(self._events, start, start + self.max_batch)]
+        return batch, cursor + len(batch), False
+
+    def subscribe(self, last_event_id=None):
+        """Return a generator of SSE messages, starting after `last_event_id` (only new changes when None)"""
+        with self._condition:
+            if self.clients >= self.max_clients:
+                raise StreamFull(f"{self.clients} clients are already subscribed")
+            cursor = self._resume_from(last_event_id)
+
+        def messages(cursor):
+            # The slot is taken once the response starts; a generator that is never
+            # iterated never runs its finally, so it must not hold one either
+            with self._condition:
+                self.clients += 1
+            try:
+                yield f"retry: {RETRY_MS}\n\n"
+                while True:
+                    with self._condition:
+                        if cursor == self._sequence:
+                            self._condition.wait(self.heartbeat)
+                        batch, cursor, missed = self._read(cursor)
+                        if missed:
+                            self.resets += 1
+                    if missed:
+                        logger.info(f"Price stream client could not resume from {last_event_id or 'a lagging cursor'}, sent a reset")
+                        # The client has to reload the products; it resumes from the newest change
+                        yield f"id: {self.event_id(cursor)}\nevent: reset\ndata: {{}}\n\n"
+                    elif batch:
+                        # A client catching up gets its backlog in one write
+                        yield ''.join(batch)
+                    else:
+                        yield ": keep-alive\n\n"
+            finally:
+                with self._condition:
+                    self.clients -= 1
+
+        return messages(cursor)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'clients': self.clients,
+                'published': self.published,
+                'resets': self.resets,
+                'buffered': len(self._events),
+                'last_event_id': self.event_id(self._sequence)
+            }
+
+
+_stream = None
+_stream_lock = threading.Lock()
+
+
+def get_price_stream():
+    """Return the process-wide price change stream"""
+    global _stream
+    with _stream_lock:
+        if _stream is None:
+            _stream = PriceStream()
+        return _stream
@@ -0,0 +1,202 @@
+import os
+import logging
+import bisect
+import threading
+from collections import OrderedDict
+from models import Settings, NotificationHistory
+import product_queries
+
+# Configure logging
+logger = logging.getLogger("snidan_product_cache")
+
+# Most products kept in memory (can be overridden in .env); the listing is served from
+# memory only while the whole catalog fits
+MAX_PRODUCTS = int(os.getenv("PRODUCT_CACHE_SIZE", "10000"))
+
+
+class ProductCache:
+    """Process-local snapshots of products, their sizes and the system counters.
+
+    Snapshots are never modified in place: every update swaps in a new
+    dict under the lock, so a reader holding a snapshot always sees a
+    consistent product. The monitor's write path pushes its changes here
+    after each commit, and other writers invalidate what they touched, so
+    there is no TTL. `version` goes up with every change.
+    """
+
+    def __init__(self, max_products=None):
+        self.max_products = max(1, max_products or MAX_PRODUCTS)
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._products = OrderedDict()
+        self._complete = False  # True while every product is cached
+        self._oversized = False  # The last full load did not fit, pages are read from the database
+        self._listing = None  # (version, products sorted by id, their ids)
+        self._counters = None
+        self._lock = threading.Lock()
+
+    def _store(self, product):
+        self._products[product['id']] = product
+        self._products.move_to_end(product['id'])
+        while len(self._products) > self.max_products:
+            self._products.popitem(last=False)
+            self._complete = False
+
+    def _changed(self):
+        self.version += 1
+        self._listing = None
+
+    def products(self, db):
+        """Return every product snapshot sorted by id, loading the catalog when it is not all in memory"""
+        with self._lock:
+            if self._complete:
+                if self._listing is None or self._listing[0] != self.version:
+                    products = sorted(self._products.values(), key=lambda product: product['id'])
+                    self._listing = (self.version, products, [product['id'] for product in products])
+                self.hits += 1
+                return self._listing[1]
+            self.misses += 1
+            version = self.version
+
+        products, _ = product_queries.load_products(db)
+        with self._lock:
+            # A write that landed while loading makes this copy stale; serve it, but do not keep it
+            self._oversized = len(products) > self.max_products
+            if self.version == version:
+                self._products.clear()
+                for product in products:
+                    self._store(product)
+                self._complete = not self._oversized
+        return products
+
+    def page(self, db, after_id=None, limit=None):
+        """Return (products, next_after_id) like product_queries.load_products(), from memory when possible"""
+        with self._lock:
+            oversized = self._oversized and not self._complete
+        if oversized:
+            # The catalog does not fit in memory, so each page is its own keyset query
+            return product_queries.load_products(db, after_id=after_id, limit=limit)
+        products = self.products(db)
+        if after_id is None:
+            first = 0
+        else:
+            listing = self._listing
+            ids = listing[2] if listing is not None and listing[1] is products else [product['id'] for product in products]
+            first = bisect.bisect_right(ids, after_id)
+        if limit is None or first + limit >= len(products):
+            return products[first:], None
+        products = products[first:first + limit]
+        return products, products[-1]['id']
+
+    def product(self, db, product_id):
+        """Return one product snapshot, or None when it does not exist"""
+        with self._lock:
+            product = self._products.get(product_id)
+            if product is not None:
+                self._products.move_to_end(product_id)
+                self.hits += 1
+                return product
+            self.misses += 1
+            version = self.version
+
+        products, _ = product_queries.load_products(db, product_id=product_id)
+        if not products:
+            return None
+        with self._lock:
+            if self.version == version:
+                self._store(products[0])
+        return products[0]
+
+    def counters(self, db):
+        """Return the product and notification counts and the last startup time"""
+        with self._lock:
+            if self._counters is not None:
+                return self._counters
+        products = self.products(db)
+        last_startup = Settings.query.filter_by(key="last_startup").first()
+        counters = {
+            'last_startup': last_startup.value if last_startup else None,
+            'product_count': len(products),
+            'active_product_count': sum(1 for product in products if product['is_active']),
+            'notification_count': NotificationHistory.query.count()
+        }
+        with self._lock:
+            self._counters = counters
+        return counters
+
+    def apply_writes(self, checked, changes):
+        """Apply a committed monitor flush: {product_id: checked_at} and the PriceChange list it produced"""
+        changes_by_product = {}
+        for change in changes:
+            changes_by_product.setdefault(change.product_id, {})[change.size_id] = change
+
+        with self._lock:
+            for product_id, checked_at in checked.items():
+                product = self._products.get(product_id)
+                if product is None:
+                    continue
+                product = dict(product, last_checked=checked_at.isoformat() if checked_at else None)
+                size_changes = changes_by_product.get(product_id)
+                if size_changes:
+                    product['sizes'] = [
+                        _apply_change(size, size_changes[size['id']]) if size['id'] in size_changes else size
+                        for size in product['sizes']
+                    ]
+                self._products[product_id] = product
+            self._changed()
+
+    def add_notifications(self, count):
+        """Count notifications recorded by the dispatcher"""
+        with self._lock:
+            if self._counters is not None:
+                self._counters = dict(self._counters, notification_count=self._counters['notification_count'] + count)
+
+    def invalidate(self, product_id=None):
+        """Forget a product after it was added, edited or deleted outside the monitor (everything when None)"""
+        with self._lock:
+            if product_id is None:
+                self._products.clear()
+            else:
+                self._products.pop(product_id, None)
+            # A product that is not cached could be new, so the listing has to be reloaded
+            self._complete = False
+            self._oversized = False
+            self._counters = None
+            self._changed()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'products': len(self._products),
+                'complete': self._complete,
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+def _apply_change(size, change):
+    """Return a copy of a size snapshot with a price change applied, like PriceWriteBuffer does in the database"""
+    price = change.new_price
+    return dict(
+        size,
+        previous_price=change.old_price,
+        current_price=price,
+        lowest_price=price if size['lowest_price'] is None else min(size['lowest_price'], price),
+        highest_price=price if size['highest_price'] is None else max(size['highest_price'], price),
+        last_updated=change.timestamp.isoformat() if change.timestamp else None
+    )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_product_cache():
+    """Return the process-wide product cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProductCache()
+        return _cache
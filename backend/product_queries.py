@@ -0,0 +1,87 @@
+import datetime
+from models import Product, Size
+
+# Fields the product APIs can return, in the order of Product.to_dict() / Size.to_dict()
+PRODUCT_FIELDS = ('id', 'url', 'name', 'image_url', 'added_at', 'last_checked', 'is_active', 'min_interval', 'max_interval')
+SIZE_FIELDS = ('id', 'product_id', 'size', 'current_price', 'previous_price', 'lowest_price', 'highest_price',
+               'notify_below', 'notify_above', 'notify_drop_percent', 'notify_on_any_change', 'last_updated')
+
+
+def parse_fields(value, allowed):
+    """Parse a comma separated `fields` query parameter; None selects every field"""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def load_products(db, fields=None, size_fields=None, product_id=None, after_id=None, limit=None):
+    """Return (products, next_after_id) as dicts shaped like Product.to_dict(), read in a single query.
+
+    `fields` selects product keys ('sizes' included); `size_fields` selects
+    the keys of each size. Products are ordered by id and paged with
+    `after_id`/`limit`; next_after_id is None on the last page.
+    """
+    fields = list(fields) if fields else list(PRODUCT_FIELDS) + ['sizes']
+    with_sizes = 'sizes' in fields
+    product_fields = [field for field in fields if field != 'sizes']
+    size_fields = list(size_fields) if size_fields else list(SIZE_FIELDS)
+
+    # The id columns are always read, they are needed to group the rows
+    product_columns = [Product.id] + [getattr(Product, field) for field in product_fields]
+    size_columns = [Size.id] + [getattr(Size, field) for field in size_fields] if with_sizes else []
+
+    page = db.session.query(Product.id)
+    if product_id is not None:
+        page = page.filter(Product.id == product_id)
+    if after_id is not None:
+        page = page.filter(Product.id > after_id)
+    if limit is not None:
+        # One extra product tells whether there is a next page
+        page = page.order_by(Product.id).limit(limit + 1)
+
+    query = db.session.query(*product_columns, *size_columns).filter(Product.id.in_(page.scalar_subquery()))
+    if with_sizes:
+        query = query.outerjoin(Size, Size.product_id == Product.id).order_by(Product.id, Size.id)
+    else:
+        query = query.order_by(Product.id)
+
+    product_count = len(product_columns)
+    products = {}
+    for row in query.all():
+        product = products.get(row[0])
+        if product is None:
+            product = products[row[0]] = {field: _serialize(value) for field, value in zip(product_fields, row[1:product_count])}
+            if with_sizes:
+                product['sizes'] = []
+        if with_sizes and row[product_count] is not None:
+            product['sizes'].append({field: _serialize(value) for field, value in zip(size_fields, row[product_count + 1:])})
+
+    # Keyed by product id, which may not be among the selected fields
+    ids = list(products)
+    next_after_id = None
+    if limit is not None and len(ids) > limit:
+        ids = ids[:limit]
+        next_after_id = ids[-1]
+    return [products[product_id] for product_id in ids], next_after_id
+
+
+def select_fields(product, fields=None, size_fields=None):
+    """Return a product dict trimmed to the requested fields, like load_products() would have read it"""
+    if not fields and not size_fields:
+        return product
+    fields = fields or list(PRODUCT_FIELDS) + ['sizes']
+    selected = {field: product[field] for field in fields if field != 'sizes'}
+    if 'sizes' in fields:
+        selected['sizes'] = [
+            {field: size[field] for field in size_fields} if size_fields else size
+            for size in product['sizes']
+        ]
+    return selected
@@ -0,0 +1,275 @@
+import os
+import csv
+import gzip
+import time
+import logging
+import datetime
+import threading
+from models import Size, PriceHistory, PriceRollup
+from price_rollups import HOURLY, bucket_start
+import http_cache
+
+# Configure logging
+logger = logging.getLogger("snidan_retention")
+
+# Retention settings (can be overridden in .env); 0 keeps the data forever.
+# Raw history older than HISTORY_RAW_RETENTION_DAYS is served from the rollups,
+# hourly rollups older than HISTORY_HOURLY_RETENTION_DAYS from the daily ones.
+RAW_RETENTION_DAYS = int(os.getenv("HISTORY_RAW_RETENTION_DAYS", "30"))
+HOURLY_RETENTION_DAYS = int(os.getenv("HISTORY_HOURLY_RETENTION_DAYS", "365"))
+COMPACTION_INTERVAL = float(os.getenv("HISTORY_COMPACTION_INTERVAL", "3600"))
+COMPACTION_BATCH = int(os.getenv("HISTORY_COMPACTION_BATCH", "2000"))
+# Pause between batches so the monitor and the API can take the write lock
+COMPACTION_PAUSE = float(os.getenv("HISTORY_COMPACTION_PAUSE", "0.1"))
+ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'archive'))
+
+RAW_COLUMNS = ('id', 'size_id', 'timestamp', 'price')
+HOURLY_COLUMNS = ('size_id', 'bucket_start', 'open_price', 'high_price', 'low_price', 'close_price', 'change_count')
+
+
+def _horizon(days, now=None):
+    """Start of the day `days` days ago, or None when the data is kept forever"""
+    if days <= 0:
+        return None
+    now = now or datetime.datetime.now()
+    return (now - datetime.timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def raw_horizon(now=None):
+    """Raw price history before this time is archived"""
+    return _horizon(RAW_RETENTION_DAYS, now)
+
+
+def hourly_horizon(now=None):
+    """Hourly rollups before this time are archived"""
+    return _horizon(HOURLY_RETENTION_DAYS, now)
+
+
+def append_archive(archive_dir, name, columns, rows, month_of):
+    """Append rows to gzip'd CSV files, one per month (`name`-YYYY-MM.csv.gz); returns the files written.
+
+    Each call adds a new gzip member, which gzip readers treat as one
+    continuous stream, so earlier batches are never rewritten.
+    """
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_of(row), []).append(row)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    paths = []
+    for month, month_rows in sorted(by_month.items()):
+        path = os.path.join(archive_dir, f"{name}-{month}.csv.gz")
+        is_new = not os.path.exists(path)
+        with gzip.open(path, 'at', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(columns)
+            writer.writerows(
+                [value.isoformat() if isinstance(value, datetime.datetime) else value for value in row]
+                for row in month_rows
+            )
+        paths.append(path)
+    return paths
+
+
+class RetentionWorker:
+    """Archive and prune expired price history in small batches on a background thread.
+
+    Each batch is its own short transaction followed by a pause, so the
+    monitor and the API are never held up for long. A batch is appended to
+    the monthly archive files only once its delete has committed, so a
+    failed commit never leaves the same rows in the archive twice.
+    """
+
+    def __init__(self, app, db, interval=None, batch_size=None, pause=None, archive_dir=None):
+        self.app = app
+        self.db = db
+        self.interval = interval or COMPACTION_INTERVAL
+        self.batch_size = max(1, batch_size or COMPACTION_BATCH)
+        self.pause = pause if pause is not None else COMPACTION_PAUSE
+        self.archive_dir = archive_dir or ARCHIVE_DIR
+        self.raw_archived = 0
+        self.hourly_archived = 0
+        self.last_run = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the retention thread unless it is already running"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="history-retention", daemon=True)
+        self._thread.start()
+        logger.info(f"History retention started (raw {RAW_RETENTION_DAYS} days, hourly rollups {HOURLY_RETENTION_DAYS} days)")
+
+    def stop(self, timeout=5):
+        """Stop after the current batch"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    self.db.session.rollback()
+                    logger.error(f"Error compacting price history: {str(e)}")
+                finally:
+                    self.db.session.remove()
+            self._stop_event.wait(self.interval)
+
+    def run_once(self, now=None):
+        """Archive and prune everything past the retention horizons, then release the freed pages"""
+        started = time.monotonic()
+        raw = hourly = 0
+        size_ids = [size_id for (size_id,) in self.db.session.query(Size.id).order_by(Size.id).all()]
+
+        cutoff = raw_horizon(now)
+        if cutoff is not None:
+            for size_id in size_ids:
+                if self._stop_event.is_set():
+                    return
+                raw += self._compact_raw(size_id, cutoff)
+
+        cutoff = hourly_horizon(now)
+        if cutoff is not None:
+            for size_id in size_ids:
+                if self._stop_event.is_set():
+                    return
+                hourly += self._compact_hourly(size_id, bucket_start(cutoff, HOURLY))
+
+        if raw or hourly:
+            self._release_space()
+            logger.info(f"Archived {raw} price history rows and {hourly} hourly rollups in {time.monotonic() - started:.1f}s")
+        self.raw_archived += raw
+        self.hourly_archived += hourly
+        self.last_run = datetime.datetime.now()
+
+    def _compact_raw(self, size_id, cutoff):
+        """Archive and delete a size's raw rows before the cutoff, batch by batch"""
+        session = self.db.session
+        # History only records changes, so the newest expired row is the price in effect
+        # at the cutoff; it stays to open the first bucket after it
+        carried = (
+            session.query(PriceHistory.id)
+            .filter(PriceHistory.size_id == size_id, PriceHistory.timestamp < cutoff)
+            .order_by(PriceHistory.timestamp.desc(), PriceHistory.id.desc())
+            .first()
+        )
+        if carried is None:
+            return 0
+
+        archived = 0
+        while not self._stop_event.is_set():
+            rows = (
+                session.query(PriceHistory.id, PriceHistory.size_id, PriceHistory.timestamp, PriceHistory.price)
+                .filter(PriceHistory.size_id == size_id, PriceHistory.timestamp < cutoff, PriceHistory.id != carried.id)
+                .order_by(PriceHistory.timestamp, PriceHistory.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            PriceHistory.query.filter(PriceHistory.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+            session.commit()
+            append_archive(self.archive_dir, 'price_history', RAW_COLUMNS, rows, lambda row: row.timestamp.strftime('%Y-%m'))
+            http_cache.bump(http_cache.HISTORY)
+            archived += len(rows)
+            time.sleep(self.pause)
+        return archived
+
+    def _compact_hourly(self, size_id, cutoff):
+        """Archive and delete a size's hourly rollups before the cutoff (epoch seconds), batch by batch"""
+        session = self.db.session
+        archived = 0
+        while not self._stop_event.is_set():
+            rows = (
+                session.query(*[getattr(PriceRollup, column) for column in HOURLY_COLUMNS])
+                .filter(PriceRollup.size_id == size_id, PriceRollup.period == HOURLY, PriceRollup.bucket_start < cutoff)
+                .order_by(PriceRollup.bucket_start)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            PriceRollup.query.filter(
+                PriceRollup.size_id == size_id,
+                PriceRollup.period == HOURLY,
+                PriceRollup.bucket_start <= rows[-1].bucket_start
+            ).delete(synchronize_session=False)
+            session.commit()
+            append_archive(
+                self.archive_dir, 'price_rollups_hourly', HOURLY_COLUMNS, rows,
+                lambda row: time.strftime('%Y-%m', time.gmtime(row.bucket_start))
+            )
+            http_cache.bump(http_cache.HISTORY)
+            archived += len(rows)
+            time.sleep(self.pause)
+        return archived
+
+    def _release_space(self):
+        """Hand freed pages back to the file system when the database uses incremental auto-vacuum"""
+        connection = self.db.session.connection()
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return
+        # A few hundred pages at a time keeps each write lock short
+        while not self._stop_event.is_set() and connection.exec_driver_sql("PRAGMA freelist_count").scalar():
+            connection.exec_driver_sql("PRAGMA incremental_vacuum(500)")
+            self.db.session.commit()
+            connection = self.db.session.connection()
+            time.sleep(self.pause)
+
+    def stats(self):
+        return {
+            'raw_archived': self.raw_archived,
+            'hourly_archived': self.hourly_archived,
+            'last_run': self.last_run.isoformat() if self.last_run else None
+        }
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_retention(app, db):
+    """Start the process-wide retention worker and return it"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = RetentionWorker(app, db)
+        _worker.start()
+        return _worker
+
+
+def get_retention_worker():
+    """Return the process-wide retention worker, or None before it is started"""
+    return _worker
+
+
+if __name__ == "__main__":
+    # python retention.py: run one archive pass now
+    # python retention.py --vacuum: switch an existing database to incremental auto-vacuum
+    # (rewrites the whole file once; stop the app first)
+    import sys
+    import sqlite3
+    from setup import db_path
+    if '--vacuum' in sys.argv:
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        logger.info("Database switched to incremental auto-vacuum")
+    else:
+        from flask import Flask
+        from database import db, init_app
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        init_app(app)
+        with app.app_context():
+            RetentionWorker(app, db).run_once()
@@ -1,12 +1,25 @@
 import os
 import datetime
-import json
-from flask import render_template, request, redirect, url_for, flash, jsonify
-from models import Product, Size, PriceHistory, NotificationHistory, Settings, NotificationSettings, SnidanSettings, User
-from scraper import get_product_info, setup_driver
+from flask import render_template, request, redirect, url_for, flash, jsonify, Response
+from models import Product, Size, PriceHistory, PriceRollup, PriceInterval, NotificationHistory, NotificationDeadLetter, NotificationSettings, SnidanSettings, User
+from scraper import get_product_info, fetch_product_info, check_saved_login
+from driver_pool import get_driver_pool
+from session_store import get_session_store
+from alert_rules import invalidate_thresholds, get_alert_gate
+from pagination import keyset_page, parse_limit
+from product_cache import get_product_cache
+from price_stream import get_price_stream, StreamFull
 import logging
 import scraper
 import monitor
+import http_client
+import notification_queue
+import product_queries
+import price_history
+import price_rollups
+import price_intervals
+import retention
+import http_cache
 import bcrypt
 from auth import generate_token
 
@@ -51,6 +64,7 @@ def register_routes(app, db):
                     size.notify_on_any_change = f'notify_on_any_change_{size_id}' in request.form
             
             db.session.commit()
+            invalidate_thresholds()
             flash('商品設定を更新しました', 'success')
             return redirect(url_for('product_list'))
         
@@ -67,6 +81,12 @@ def register_routes(app, db):
             # Update product status
             product.is_active = data.get('is_active', False)
             
+            # Update polling limits
+            if 'min_interval' in data:
+                product.min_interval = data.get('min_interval')
+            if 'max_interval' in data:
+                product.max_interval = data.get('max_interval')
+            
             # Update size notification settings
             received_sizes = {size['id']: size for size in data.get('sizes', [])}
             
@@ -75,9 +95,15 @@ def register_routes(app, db):
                     size_data = received_sizes[size.id]
                     size.notify_below = size_data.get('notify_below')
                     size.notify_above = size_data.get('notify_above')
+                    size.notify_drop_percent = size_data.get('notify_drop_percent')
                     size.notify_on_any_change = size_data.get('notify_on_any_change', False)
             
+            # New thresholds start with a clean alert state (only for this product's sizes)
+            get_alert_gate(db).clear(received_sizes.keys() & {size.id for size in product.sizes})
             db.session.commit()
+            invalidate_thresholds()
+            get_product_cache().invalidate(product_id)
+            http_cache.bump(http_cache.PRODUCTS)
             return jsonify({'message': '商品設定を更新しました'}), 200
             
         except Exception as e:
@@ -85,14 +111,31 @@ def register_routes(app, db):
             return jsonify({'error': str(e)}), 400
     
     
+    def delete_product_data(product):
+        """Delete a product with its sizes, price history, rollups, intervals, alert state and queued notifications, and commit"""
+        # One statement per table
+        size_ids = db.session.query(Size.id).filter(Size.product_id == product.id).scalar_subquery()
+        PriceHistory.query.filter(PriceHistory.size_id.in_(size_ids)).delete(synchronize_session=False)
+        PriceRollup.query.filter(PriceRollup.size_id.in_(size_ids)).delete(synchronize_session=False)
+        PriceInterval.query.filter(PriceInterval.size_id.in_(size_ids)).delete(synchronize_session=False)
+        # Size ids are reused, so the gate's in-memory state has to go with the rows
+        get_alert_gate(db).clear([size.id for size in product.sizes])
+        notification_queue.delete_product_notifications(product.id)
+        Size.query.filter_by(product_id=product.id).delete()
+        
+        # Delete the product
+        db.session.delete(product)
+        db.session.commit()
+        get_product_cache().invalidate(product.id)
+        http_cache.bump(http_cache.PRODUCTS, http_cache.HISTORY, http_cache.NOTIFICATIONS)
+    
     @app.route('/v1/products/<int:product_id>/delete', methods=['POST'])
     def delete_product(product_id):
         """Delete product"""
         product = Product.query.get_or_404(product_id)
         
         try:
-            db.session.delete(product)
-            db.session.commit()
+            delete_product_data(product)
             flash('商品を削除しました', 'success')
         except Exception as e:
             db.session.rollback()
@@ -100,22 +143,6 @@ def register_routes(app, db):
         
         return redirect(url_for('product_list'))
     
-    @app.route('/v1/products/<int:product_id>/history')
-    def product_history(product_id):
-        """Product price history page"""
-        product = Product.query.get_or_404(product_id)
-        
-        # Get price history for each size
-        history_data = {}
-        for size in product.sizes:
-            history = PriceHistory.query.filter_by(size_id=size.id).order_by(PriceHistory.timestamp).all()
-            history_data[size.size] = [
-                {'date': h.timestamp.strftime('%Y-%m-%d %H:%M'), 'price': h.price}
-                for h in history
-            ]
-        
-        return render_template('product_history.html', product=product, history_data=json.dumps(history_data))
-    
     @app.route('/v1/settings/snidan', methods=['GET'])
     def get_snidan_settings():
         """Get Snidan settings page"""
@@ -129,50 +156,220 @@ def register_routes(app, db):
         
         try:
             data = request.get_json()  # Get JSON data instead of form data
-            settings.username = data.get('username', settings.username)
-            settings.password = data.get('password', settings.password)
+            username = data.get('username', settings.username)
+            password = data.get('password', settings.password)
+            credentials_changed = settings.username != username or settings.password != password
+            settings.username = username
+            settings.password = password
             settings.monitoring_interval = int(data.get('monitoring_interval', 10))
             
             db.session.commit()
+            if credentials_changed:
+                # New credentials invalidate the saved Snidan session
+                get_session_store().clear()
             return jsonify({'message': 'スニダン設定を更新しました'}), 200
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': str(e)}), 400
     
+    def notification_history_page():
+        """One page of notification history, newest first, filtered by the query parameters"""
+        query = (
+            db.session.query(
+                NotificationHistory.id,
+                NotificationHistory.product_id,
+                Product.name,
+                NotificationHistory.size_id,
+                Size.size,
+                NotificationHistory.old_price,
+                NotificationHistory.new_price,
+                NotificationHistory.notification_type,
+                NotificationHistory.sent_to,
+                NotificationHistory.timestamp
+            )
+            .outerjoin(Product, Product.id == NotificationHistory.product_id)
+            .outerjoin(Size, Size.id == NotificationHistory.size_id)
+        )
+        filters = {
+            'product_id': (NotificationHistory.product_id, int),
+            'size_id': (NotificationHistory.size_id, int),
+            'channel': (NotificationHistory.sent_to, str),
+            'type': (NotificationHistory.notification_type, str)
+        }
+        for name, (column, convert) in filters.items():
+            value = request.args.get(name)
+            if value:
+                query = query.filter(column == convert(value))
+        
+        rows, next_cursor = keyset_page(
+            query, NotificationHistory.timestamp, NotificationHistory.id,
+            cursor=request.args.get('cursor'), limit=parse_limit(request.args.get('limit'))
+        )
+        notifications = [
+            {
+                'id': row.id,
+                'product_id': row.product_id,
+                'product_name': row.name,
+                'size_id': row.size_id,
+                'size': row.size,
+                'old_price': row.old_price,
+                'new_price': row.new_price,
+                'notification_type': row.notification_type,
+                'sent_to': row.sent_to,
+                'timestamp': row.timestamp.isoformat() if row.timestamp else None
+            }
+            for row in rows
+        ]
+        return jsonify({'notifications': notifications, 'next_cursor': next_cursor})
+    
     @app.route('/v1/notifications')
     def notification_history():
-        """Notification history page"""
-        notifications = NotificationHistory.query.order_by(NotificationHistory.timestamp.desc()).limit(100).all()
-        return render_template('notification_history.html', notifications=notifications)
+        """Notification history (same as /v1/notifications/history)"""
+        return api_notification_history()
     
     @app.route('/v1/products')
+    @http_cache.conditional(http_cache.PRODUCTS)
     def api_products():
-        """API endpoint for products"""
-        products = Product.query.all()
-        return jsonify([product.to_dict() for product in products])
+        """API endpoint for products, paged with ?limit=&after=<last id> and trimmed with ?fields=&size_fields="""
+        try:
+            limit = request.args.get('limit')
+            after_id = request.args.get('after')
+            fields = product_queries.parse_fields(request.args.get('fields'), product_queries.PRODUCT_FIELDS + ('sizes',))
+            size_fields = product_queries.parse_fields(request.args.get('size_fields'), product_queries.SIZE_FIELDS)
+            products, next_after_id = get_product_cache().page(
+                db,
+                after_id=int(after_id) if after_id else None,
+                limit=parse_limit(limit) if limit else None
+            )
+        except ValueError as e:
+            return jsonify({'error': f'不正なパラメータです: {str(e)}'}), 400
+        
+        response = jsonify([product_queries.select_fields(product, fields, size_fields) for product in products])
+        if next_after_id is not None:
+            # The body stays a plain list, the id to pass as ?after= for the next page goes in a header
+            response.headers['X-Next-After'] = str(next_after_id)
+            response.headers['Access-Control-Expose-Headers'] = 'X-Next-After'
+        return response
     
     @app.route('/v1/products/<int:product_id>')
     def api_product(product_id):
         """API endpoint for a single product"""
         try:
-            product = Product.query.get_or_404(product_id)
-            if product:
-                product.sizes = Size.query.filter_by(product_id=product_id).all()
-            return jsonify(product.to_dict()), 200  # Explicitly return 200 OK status
+            fields = product_queries.parse_fields(request.args.get('fields'), product_queries.PRODUCT_FIELDS + ('sizes',))
+            size_fields = product_queries.parse_fields(request.args.get('size_fields'), product_queries.SIZE_FIELDS)
+            product = get_product_cache().product(db, product_id)
+        except ValueError as e:
+            return jsonify({'error': f'不正なパラメータです: {str(e)}'}), 400
         except Exception as e:
             return jsonify({'error': str(e)}), 500  # Handle unexpected errors gracefully
+        
+        if product is None:
+            return jsonify({'error': '商品が見つかりません'}), 404
+        return jsonify(product_queries.select_fields(product, fields, size_fields)), 200
     
     @app.route('/v1/products/<int:product_id>/history')
+    @http_cache.conditional(http_cache.HISTORY)
     def api_product_history(product_id):
-        """API endpoint for product price history"""
-        product = Product.query.get_or_404(product_id)
+        """API endpoint for product price history, downsampled per size for charts.
+
+        ?from=&to= limit the time range (ISO 8601, local time unless an
+        offset is given), ?mode=ohlc (default) buckets prices by
+        ?resolution= (e.g. 15m, 1h, 1d; auto by default) and ?mode=lttb
+        keeps the most significant samples. Either way no size returns more
+        than ?points= entries.
+        """
+        if not db.session.query(Product.id).filter(Product.id == product_id).first():
+            return jsonify({'error': '商品が見つかりません'}), 404
+        try:
+            points = request.args.get('points')
+            history = price_history.product_history(
+                db, product_id,
+                start=price_history.parse_time(request.args.get('from')),
+                end=price_history.parse_time(request.args.get('to')),
+                resolution=price_history.parse_resolution(request.args.get('resolution')),
+                points=parse_limit(points, maximum=price_history.MAX_POINTS) if points else None,
+                mode=request.args.get('mode', 'ohlc')
+            )
+        except ValueError as e:
+            return jsonify({'error': f'不正なパラメータです: {str(e)}'}), 400
+        return jsonify(history)
+    
+    @app.route('/v1/history/series')
+    def api_history_series():
+        """API endpoint for the price series of many sizes at once, rebuilt from the price intervals.
+
+        Sizes are picked with ?product_ids= and/or ?size_ids= (comma
+        separated). Prices are sampled on one shared grid from ?from= to ?to=
+        (ISO 8601, offsets converted to local time; the last 7 days by
+        default) every ?resolution= (auto by default,
+        at most ?points= samples); null marks times the size was not being
+        polled. ?resolution=raw returns the intervals themselves.
+        """
+        try:
+            product_ids = [int(value) for value in request.args.get('product_ids', '').split(',') if value]
+            size_ids = [int(value) for value in request.args.get('size_ids', '').split(',') if value]
+            # parse_time returns naive local times, comparable with now() and the stored intervals
+            end = price_history.parse_time(request.args.get('to')) or datetime.datetime.now()
+            start = price_history.parse_time(request.args.get('from')) or end - datetime.timedelta(days=7)
+            if start >= end:
+                raise ValueError("from must be before to")
+            raw = request.args.get('resolution') == 'raw'
+            resolution = None if raw else price_history.parse_resolution(request.args.get('resolution'))
+            points = request.args.get('points')
+            points = parse_limit(points, maximum=price_history.MAX_POINTS) if points else price_history.DEFAULT_POINTS
+        except ValueError as e:
+            return jsonify({'error': f'不正なパラメータです: {str(e)}'}), 400
+        if not product_ids and not size_ids:
+            return jsonify({'error': 'product_ids または size_ids を指定してください'}), 400
         
-        history_data = {}
-        for size in product.sizes:
-            history = PriceHistory.query.filter_by(size_id=size.id).order_by(PriceHistory.timestamp).all()
-            history_data[size.size] = [h.to_dict() for h in history]
+        sizes = (
+            db.session.query(Size.id, Size.product_id, Size.size)
+            .filter(Size.id.in_(size_ids) | Size.product_id.in_(product_ids))
+            .order_by(Size.product_id, Size.id)
+            .all()
+        )
+        result = {'from': start.isoformat(), 'to': end.isoformat()}
+        if raw:
+            intervals = price_intervals.load(db, [size.id for size in sizes], start, end)
+            result['sizes'] = [
+                {
+                    'size_id': size.id,
+                    'product_id': size.product_id,
+                    'size': size.size,
+                    'valid_from': price_history.to_iso(intervals[size.id][0]),
+                    'valid_to': price_history.to_iso(intervals[size.id][1]),
+                    'price': intervals[size.id][2].tolist()
+                }
+                for size in sizes
+            ]
+            return jsonify(result)
+        
+        width = price_history.bucket_width((end - start).total_seconds(), points, resolution)
+        grid, series = price_intervals.series(db, [size.id for size in sizes], start, end, width)
+        result.update({
+            'resolution': width,
+            't': price_history.to_iso(grid),
+            'sizes': [
+                {'size_id': size.id, 'product_id': size.product_id, 'size': size.size, **series[size.id]}
+                for size in sizes
+            ]
+        })
+        return jsonify(result)
+    
+    @app.route('/v1/stream/prices')
+    def api_price_stream():
+        """Server-Sent Events stream of price changes, resumed after the Last-Event-ID header or ?last_event_id="""
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            messages = get_price_stream().subscribe(last_event_id)
+        except StreamFull:
+            return jsonify({'error': '接続数が上限に達しています'}), 503
         
-        return jsonify(history_data)
+        return Response(messages, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            # Keep reverse proxies from buffering the stream
+            'X-Accel-Buffering': 'no'
+        })
     
     @app.route('/v1/products/add', methods=['POST'])
     def api_add_product():
@@ -200,28 +397,30 @@ def register_routes(app, db):
                 logger.error("Snidan settings not found in the database.")
                 return jsonify({'error': 'Snidan settings not found.'}), 404
             
-            # Get product info from Snidan
-            try:
-                driver = setup_driver()
-                product_info = get_product_info(driver, url, snidan_settings.username, snidan_settings.password)
-                driver.quit()
-            except Exception as scraper_error:
-                logger.error(f"Error scraping product info: {str(scraper_error)}")
-                # For testing/development, create a mock product
-                if app.config.get('DEBUG', False):
-                    product_id = url.split('/')[-1] if '/' in url else url
-                    product_info = {
-                        'name': 'Test Product - ' + product_id,
-                        'image_url': 'https://placehold.co/300x300',
-                        'sizes': [
-                            {'size': '26.0cm', 'price': 10000},
-                            {'size': '27.0cm', 'price': 12000},
-                            {'size': '28.0cm', 'price': 15000},
-                        ]
-                    }
-                else:
-                    return jsonify({'error': f'Failed to scrape product information: {str(scraper_error)}'}), 500
-                driver.quit()
+            # Get product info from Snidan over plain HTTP first
+            product_info = fetch_product_info(url)
+            
+            # Fall back to the browser when the page or API could not be parsed
+            if not product_info:
+                try:
+                    with get_driver_pool().driver() as driver:
+                        product_info = get_product_info(driver, url, snidan_settings.username, snidan_settings.password)
+                except Exception as scraper_error:
+                    logger.error(f"Error scraping product info: {str(scraper_error)}")
+                    # For testing/development, create a mock product
+                    if app.config.get('DEBUG', False):
+                        product_id = url.split('/')[-1] if '/' in url else url
+                        product_info = {
+                            'name': 'Test Product - ' + product_id,
+                            'image_url': 'https://placehold.co/300x300',
+                            'sizes': [
+                                {'size': '26.0cm', 'price': 10000},
+                                {'size': '27.0cm', 'price': 12000},
+                                {'size': '28.0cm', 'price': 15000},
+                            ]
+                        }
+                    else:
+                        return jsonify({'error': f'Failed to scrape product information: {str(scraper_error)}'}), 500
                 
             if not product_info:
                 return jsonify({'error': 'Failed to get product information. Check the URL and make sure you are logged into Snidan.'}), 400
@@ -238,6 +437,7 @@ def register_routes(app, db):
             db.session.flush()  # Get product ID
             
             # Add sizes
+            history_rows = []
             for size_info in product_info['sizes']:
                 size = Size(
                     product_id=product.id,
@@ -247,16 +447,18 @@ def register_routes(app, db):
                     last_updated=datetime.datetime.now()
                 )
                 db.session.add(size)
+                db.session.flush()  # Get size ID
                 
                 # Add initial price history
-                price_history = PriceHistory(
-                    size_id=size.id,
-                    price=size_info['price'],
-                    timestamp=datetime.datetime.now()
-                )
-                db.session.add(price_history)
+                history_rows.append({'size_id': size.id, 'price': size_info['price'], 'timestamp': datetime.datetime.now()})
             
+            db.session.bulk_insert_mappings(PriceHistory, history_rows)
+            price_rollups.record(db.session, history_rows)
+            price_intervals.record(db.session, [(row['size_id'], row['price'], row['timestamp']) for row in history_rows], [])
             db.session.commit()
+            invalidate_thresholds()
+            get_product_cache().invalidate(product.id)
+            http_cache.bump(http_cache.PRODUCTS, http_cache.HISTORY)
             return jsonify({'success': True, 'product': product.to_dict()}), 201
             
         except Exception as e:
@@ -270,16 +472,7 @@ def register_routes(app, db):
         product = Product.query.get_or_404(product_id)
         
         try:
-            # Delete associated sizes and price history
-            for size in product.sizes:
-                PriceHistory.query.filter_by(size_id=size.id).delete()
-            
-            Size.query.filter_by(product_id=product.id).delete()
-            
-            # Delete the product
-            db.session.delete(product)
-            db.session.commit()
-            
+            delete_product_data(product)
             return jsonify({'success': True}), 200
         except Exception as e:
             db.session.rollback()
@@ -348,6 +541,7 @@ def register_routes(app, db):
             settings.chatwork_room_id = data.get('chatwork_room_id', settings.chatwork_room_id)
             
             db.session.commit()
+            notification_queue.invalidate_settings_cache()
             return jsonify({'success': True}), 200
         except Exception as e:
             db.session.rollback()
@@ -381,6 +575,10 @@ def register_routes(app, db):
                     settings = SnidanSettings()
                     db.session.add(settings)
                 
+                if settings.username != data.get('username', '') or settings.password != data.get('password', ''):
+                    # New credentials invalidate the saved Snidan session
+                    get_session_store().clear()
+                
                 settings.username = data.get('username', '')
                 settings.password = data.get('password', '')
                 settings.interval = data.get('interval', 10)
@@ -392,30 +590,64 @@ def register_routes(app, db):
                 return jsonify({'error': str(e)}), 500
     
     @app.route('/v1/notifications/history')
+    @http_cache.conditional(http_cache.NOTIFICATIONS)
     def api_notification_history():
-        """API endpoint for notification history"""
-        notifications = NotificationHistory.query.order_by(NotificationHistory.timestamp.desc()).limit(100).all()
-        return jsonify([notification.to_dict() for notification in notifications])
+        """API endpoint for notification history, paged with ?cursor= and filtered by product_id, size_id, channel and type"""
+        try:
+            return notification_history_page()
+        except ValueError as e:
+            return jsonify({'error': f'不正なパラメータです: {str(e)}'}), 400
+    
+    @app.route('/v1/notifications/dead-letters')
+    def api_notification_dead_letters():
+        """API endpoint for notifications that could not be delivered"""
+        letters = NotificationDeadLetter.query.order_by(NotificationDeadLetter.failed_at.desc()).limit(100).all()
+        return jsonify([letter.to_dict() for letter in letters])
+    
+    @app.route('/v1/notifications/dead-letters/replay', methods=['POST'])
+    def api_replay_dead_letters():
+        """API endpoint for queueing dead-lettered notifications again (all of them unless ids are given)"""
+        data = request.get_json(silent=True) or {}
+        try:
+            replayed = notification_queue.replay_dead_letters(db, data.get('ids'))
+            return jsonify({'success': True, 'replayed': replayed}), 200
+        except Exception as e:
+            logger.error(f"Error replaying dead-lettered notifications: {str(e)}")
+            return jsonify({'error': str(e)}), 500
     
     @app.route('/v1/system/status')
     def api_system_status():
         """API endpoint for system status"""
-        # Get last startup time
-        last_startup = Settings.query.filter_by(key="last_startup").first()
-        
-        # Get product and notification counts
-        product_count = Product.query.count()
-        active_product_count = Product.query.filter_by(is_active=True).count()
-        notification_count = NotificationHistory.query.count()
+        # Startup time and product and notification counts, kept in memory
+        counters = get_product_cache().counters(db)
         
         return jsonify({
-            'last_startup': last_startup.value if last_startup else None,
-            'product_count': product_count,
-            'active_product_count': active_product_count,
-            'notification_count': notification_count,
+            **counters,
             'monitoring_active': True  # This should be updated to reflect the actual status
         }) 
     
+    @app.route('/v1/system/metrics')
+    def api_system_metrics():
+        """API endpoint for runtime performance metrics"""
+        return jsonify({
+            'http_pools': http_client.get_pool_stats(),
+            'price_fetch': scraper.get_fetch_stats(),
+            'driver_pool': get_driver_pool().stats(),
+            'notification_queue': notification_queue.get_dispatcher().stats() if notification_queue.get_dispatcher() else None,
+            'alerts': get_alert_gate(db).stats(),
+            'product_cache': get_product_cache().stats(),
+            'price_stream': get_price_stream().stats(),
+            'response_cache': http_cache.get_response_cache().stats(),
+            'retention': retention.get_retention_worker().stats() if retention.get_retention_worker() else None
+        })
+    
+    @app.route('/v1/system/scheduler')
+    def api_system_scheduler():
+        """API endpoint for the polling scheduler's current decisions"""
+        if monitor.active_scheduler is None:
+            return jsonify({'error': 'Monitoring is not running'}), 503
+        return jsonify(monitor.active_scheduler.snapshot())
+    
     @app.route('/v1/system/loginstatus')
     def api_system_loginstatus():
         """API endpoint for system loginstatus"""
@@ -423,9 +655,16 @@ def register_routes(app, db):
         login_info = SnidanSettings.query.first()
         username = login_info.username
         password = login_info.password
-        driver = scraper.setup_driver()
-        login_res = scraper.login_to_snidan(driver, username, password)
-        driver.quit()
+        pool = get_driver_pool()
+        try:
+            # Only fall back to a browser login when the saved session has expired
+            login_res = check_saved_login(username)
+            if not login_res:
+                with pool.driver(username, password) as driver:
+                    login_res = pool.is_logged_in(driver)
+        except Exception as e:
+            logger.error(f"Error checking Snidan login: {str(e)}")
+            login_res = False
         if login_res:
             return jsonify({'success': 'ログインに成功しました。'}), 200
         else:
@@ -443,9 +682,16 @@ def register_routes(app, db):
         login_info = SnidanSettings.query.first()
         username = login_info.username
         password = login_info.password
-        driver = scraper.setup_driver()
-        login_res = scraper.login_to_snidan(driver, username, password)
-        driver.quit()
+        pool = get_driver_pool()
+        try:
+            # Only fall back to a browser login when the saved session has expired
+            login_res = check_saved_login(username)
+            if not login_res:
+                with pool.driver(username, password) as driver:
+                    login_res = pool.is_logged_in(driver)
+        except Exception as e:
+            logger.error(f"Error checking Snidan login: {str(e)}")
+            login_res = False
         if login_res:
             return jsonify({'success': 'ログインに成功しました。'}), 200
         else:
@@ -0,0 +1,190 @@
+import os
+import time
+import heapq
+import logging
+import datetime
+import threading
+from sqlalchemy import func
+from models import Size, PriceRollup
+from price_rollups import HOURLY, bucket_start
+
+# Configure logging
+logger = logging.getLogger("snidan_scheduler")
+
+# Scheduler settings (can be overridden in .env)
+DEFAULT_MAX_INTERVAL = int(os.getenv("MONITOR_MAX_INTERVAL", "900"))
+VOLATILITY_WINDOW_HOURS = int(os.getenv("MONITOR_VOLATILITY_WINDOW_HOURS", "24"))
+# Each price change per hour shortens the interval by this factor
+VOLATILITY_WEIGHT = float(os.getenv("MONITOR_VOLATILITY_WEIGHT", "2.0"))
+# Products whose price is within this fraction of a threshold are polled more often
+PROXIMITY_BAND = float(os.getenv("MONITOR_PROXIMITY_BAND", "0.05"))
+
+
+def load_poll_stats(db, product_ids, now=None):
+    """Return {product_id: (changes_per_hour, proximity)} computed from the database.
+
+    changes_per_hour is the number of recorded price changes across all sizes in
+    the volatility window. proximity is the smallest relative distance between a
+    size's current price and its notify_below/notify_above threshold (None when
+    the product has no thresholds).
+    """
+    if not product_ids:
+        return {}
+    now = now or datetime.datetime.now()
+    since = now - datetime.timedelta(hours=VOLATILITY_WINDOW_HOURS)
+
+    # Counted from the hourly rollups (the window starts at the top of the hour)
+    change_counts = dict(
+        db.session.query(Size.product_id, func.sum(PriceRollup.change_count))
+        .join(PriceRollup, PriceRollup.size_id == Size.id)
+        .filter(
+            Size.product_id.in_(product_ids),
+            PriceRollup.period == HOURLY,
+            PriceRollup.bucket_start >= bucket_start(since, HOURLY)
+        )
+        .group_by(Size.product_id)
+        .all()
+    )
+
+    proximities = {}
+    size_rows = (
+        db.session.query(Size.product_id, Size.current_price, Size.notify_below, Size.notify_above)
+        .filter(Size.product_id.in_(product_ids))
+        .all()
+    )
+    for product_id, current_price, notify_below, notify_above in size_rows:
+        if not current_price:
+            continue
+        for threshold in (notify_below, notify_above):
+            if not threshold:
+                continue
+            distance = abs(current_price - threshold) / threshold
+            if product_id not in proximities or distance < proximities[product_id]:
+                proximities[product_id] = distance
+
+    return {
+        product_id: (change_counts.get(product_id, 0) / VOLATILITY_WINDOW_HOURS, proximities.get(product_id))
+        for product_id in product_ids
+    }
+
+
+def compute_interval(changes_per_hour, proximity, min_interval, max_interval):
+    """Return (interval_seconds, reason) for a product's next poll"""
+    interval = max_interval / (1 + VOLATILITY_WEIGHT * changes_per_hour)
+    reason = "volatility" if changes_per_hour else "idle"
+
+    if proximity is not None and proximity < PROXIMITY_BAND:
+        # Scale down linearly as the price approaches the threshold
+        interval = min(interval, max_interval * proximity / PROXIMITY_BAND)
+        reason = "near_threshold"
+
+    if interval <= min_interval:
+        return min_interval, reason
+    return min(interval, max_interval), reason
+
+
+class PollScheduler:
+    """Priority queue of products ordered by their next poll time"""
+
+    def __init__(self, min_interval, max_interval=None):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval or DEFAULT_MAX_INTERVAL, min_interval)
+        self._heap = []
+        self._due = {}
+        self._limits = {}
+        self._decisions = {}
+        self._lock = threading.Lock()
+
+    def sync(self, products):
+        """Track the given (id, min_interval, max_interval) rows and drop all others.
+
+        Newly seen products are due immediately.
+        """
+        now = time.time()
+        with self._lock:
+            seen = set()
+            for product_id, min_interval, max_interval in products:
+                seen.add(product_id)
+                self._limits[product_id] = (min_interval, max_interval)
+                if product_id not in self._due:
+                    self._push(product_id, now)
+            for product_id in list(self._due):
+                if product_id not in seen:
+                    del self._due[product_id]
+                    self._limits.pop(product_id, None)
+                    self._decisions.pop(product_id, None)
+
+    def _push(self, product_id, due_at):
+        self._due[product_id] = due_at
+        heapq.heappush(self._heap, (due_at, product_id))
+
+    def pop_due(self, now=None):
+        """Remove and return the ids of all products whose poll time has come"""
+        now = now or time.time()
+        due_ids = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, product_id = heapq.heappop(self._heap)
+                # Skip stale heap entries left behind by rescheduling or removal
+                if self._due.get(product_id) != due_at:
+                    continue
+                self._due[product_id] = None
+                due_ids.append(product_id)
+        return due_ids
+
+    def _limits_for(self, product_id):
+        """Return the effective (min, max) interval for a product"""
+        min_override, max_override = self._limits.get(product_id, (None, None))
+        min_interval = max(min_override or self.min_interval, self.min_interval)
+        max_interval = max(max_override or self.max_interval, min_interval)
+        return min_interval, max_interval
+
+    def reschedule(self, stats, now=None):
+        """Schedule the next poll for each product in {product_id: (changes_per_hour, proximity)}"""
+        now = now or time.time()
+        with self._lock:
+            for product_id, (changes_per_hour, proximity) in stats.items():
+                if product_id not in self._due:
+                    continue
+                min_interval, max_interval = self._limits_for(product_id)
+                interval, reason = compute_interval(changes_per_hour, proximity, min_interval, max_interval)
+                self._push(product_id, now + interval)
+                self._decisions[product_id] = {
+                    'product_id': product_id,
+                    'interval': round(interval, 1),
+                    'reason': reason,
+                    'changes_per_hour': round(changes_per_hour, 3),
+                    'proximity': round(proximity, 4) if proximity is not None else None,
+                    'next_poll_at': datetime.datetime.fromtimestamp(now + interval).isoformat()
+                }
+                logger.debug(f"Product {product_id} next poll in {interval:.0f}s ({reason})")
+
+    def release(self, product_ids, now=None):
+        """Put popped products that were not rescheduled back in the queue, due after the minimum interval"""
+        now = now or time.time()
+        with self._lock:
+            for product_id in product_ids:
+                if product_id in self._due and self._due[product_id] is None:
+                    self._push(product_id, now + self._limits_for(product_id)[0])
+
+    def seconds_until_next(self, now=None):
+        """Return seconds until the earliest scheduled poll (None when nothing is scheduled)"""
+        now = now or time.time()
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max(self._heap[0][0] - now, 0)
+
+    def snapshot(self):
+        """Return the scheduler state and its latest decisions, soonest first"""
+        with self._lock:
+            decisions = sorted(self._decisions.values(), key=lambda d: d['next_poll_at'])
+            return {
+                'min_interval': self.min_interval,
+                'max_interval': self.max_interval,
+                'tracked_products': len(self._due),
+                'in_flight': sum(1 for due_at in self._due.values() if due_at is None),
+                'decisions': decisions
+            }
@@ -1,6 +1,11 @@
 import os
 import time
+import json
+import hashlib
 import logging
+import shutil
+import tempfile
+import threading
 import re
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -12,6 +17,8 @@ from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from webdriver_manager.chrome import ChromeDriverManager
 from bs4 import BeautifulSoup
 import requests
+from http_client import get_session
+from session_store import get_session_store
 from database import db
 from models import SnidanSettings
 from datetime import datetime  # Add this import at the top of your file
@@ -19,23 +26,103 @@ from datetime import datetime  # Add this import at the top of your file
 # Configure logging
 logger = logging.getLogger("snidan_scraper")
 
+# Browser-like headers sent with every request to the Snidan API
+SNKRDUNK_HEADERS = {
+    'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'accept-language': 'en-US,en;q=0.9',
+    'cache-control': 'max-age=0',
+    'sec-ch-ua': '"Chromium";v="134", "Not:A-Brand";v="24", "Google Chrome";v="134"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'document',
+    'sec-fetch-mode': 'navigate',
+    'sec-fetch-site': 'none',
+    'sec-fetch-user': '?1',
+    'upgrade-insecure-requests': '1',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36'
+}
 
-def setup_driver():
+
+# Returned by get_current_prices(conditional=True) when the size list has not changed
+PRICES_UNCHANGED = object()
+
+# Validators and fingerprints of the last processed size list, keyed by product URL
+_response_cache = {}
+_response_cache_lock = threading.Lock()
+
+# Counters for conditional price fetches
+_fetch_stats = {'requests': 0, 'not_modified': 0, 'body_unchanged': 0, 'fingerprint_unchanged': 0}
+_fetch_stats_lock = threading.Lock()
+
+
+def _size_label(raw_size):
+    """Convert Snidan's numeric size code to a label such as '26.5cm'"""
+    # Calculate size using the formula
+    calculated_size = 20 + (raw_size - 12) * 0.5
+    size_str = f"{calculated_size:.1f}"
+    if size_str.endswith('.0'):
+        size_str = size_str[:-2]
+    return f"{size_str}cm"
+
+
+SNKRDUNK_BASE_URL = "https://snkrdunk.com/"
+# Page that requires a login; used to check whether saved cookies are still valid
+SESSION_PROBE_URL = os.getenv("SNIDAN_SESSION_PROBE_URL", "https://snkrdunk.com/mypage")
+
+
+def get_scraper_session():
+    """Return the shared keep-alive session used for Snidan API requests"""
+    return get_session("snkrdunk", headers=SNKRDUNK_HEADERS)
+
+
+# Prefix of the temporary Chrome profile directories created by setup_driver
+PROFILE_DIR_PREFIX = "chrome-profile-"
+
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+
+def _get_chromedriver_path():
+    """Resolve the chromedriver binary once per process"""
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path is None:
+            _chromedriver_path = ChromeDriverManager().install()
+        return _chromedriver_path
+
+def setup_driver(headless=False):
     """Set up and return a Chrome WebDriver instance"""
     chrome_options = Options()
-    # chrome_options.add_argument("--headless")
+    if headless:
+        chrome_options.add_argument("--headless=new")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
 
-    chrome_options.add_argument(f"--user-data-dir=/tmp/chrome-profile-{str(hash(str(id(chrome_options))))}")
+    profile_dir = tempfile.mkdtemp(prefix=PROFILE_DIR_PREFIX)
+    chrome_options.add_argument(f"--user-data-dir={profile_dir}")
 
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=chrome_options)
+    service = Service(_get_chromedriver_path())
+    try:
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+    except Exception:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        raise
+    driver.profile_dir = profile_dir
     
     return driver
 
+def quit_driver(driver):
+    """Quit a WebDriver and remove its temporary profile directory"""
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.warning(f"Error quitting driver: {str(e)}")
+    profile_dir = getattr(driver, "profile_dir", None)
+    if profile_dir:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
 def login_to_snidan(driver, username, password):
     """Log in to Snidan using the provided credentials"""
     try:
@@ -128,6 +215,144 @@ def login_to_snidan(driver, username, password):
         logger.error(f"Error logging in to Snidan: {str(e)}")
         return False
 
+def _cookie_for_driver(cookie):
+    """Keep only the cookie fields WebDriver's add_cookie accepts"""
+    allowed = ('name', 'value', 'path', 'domain', 'secure', 'httpOnly', 'expiry', 'sameSite')
+    return {key: value for key, value in cookie.items() if key in allowed}
+
+def apply_cookies_to_session(session, cookies):
+    """Load saved WebDriver cookies into a requests session"""
+    for cookie in cookies:
+        session.cookies.set(
+            cookie['name'],
+            cookie['value'],
+            domain=cookie.get('domain'),
+            path=cookie.get('path', '/')
+        )
+
+def apply_cookies_to_driver(driver, cookies):
+    """Load saved cookies into a WebDriver (it must visit the domain first)"""
+    driver.get(SNKRDUNK_BASE_URL)
+    for cookie in cookies:
+        try:
+            driver.add_cookie(_cookie_for_driver(cookie))
+        except Exception as e:
+            logger.debug(f"Skipping cookie {cookie.get('name')}: {str(e)}")
+
+def probe_session(session=None):
+    """Return True when the session's cookies are still logged in to Snidan"""
+    session = session or get_scraper_session()
+    try:
+        response = session.get(SESSION_PROBE_URL, allow_redirects=False)
+    except Exception as e:
+        logger.warning(f"Error probing Snidan session: {str(e)}")
+        return False
+    # Logged-out requests are redirected to the login page or refused
+    if response.status_code in (401, 403):
+        return False
+    if response.is_redirect and 'login' in response.headers.get('Location', ''):
+        return False
+    return response.status_code == 200
+
+def check_saved_login(username):
+    """Return True when the saved session for username is still valid, without a browser"""
+    cookies = get_session_store().load(username)
+    if not cookies:
+        return False
+    session = get_scraper_session()
+    apply_cookies_to_session(session, cookies)
+    if probe_session(session):
+        return True
+    logger.info("Saved Snidan session is no longer valid")
+    get_session_store().clear()
+    return False
+
+def ensure_logged_in(driver, username, password):
+    """Log the driver in, reusing the saved session and only logging in again when it has expired"""
+    if check_saved_login(username):
+        apply_cookies_to_driver(driver, get_session_store().load(username))
+        logger.info("Reused saved Snidan session")
+        return True
+
+    if not login_to_snidan(driver, username, password):
+        return False
+
+    # Wait for the login redirect so the session cookies are set before saving them
+    try:
+        WebDriverWait(driver, 10).until(lambda d: '/accounts/login' not in d.current_url)
+    except TimeoutException:
+        logger.warning("Still on the login page after submitting credentials")
+        return False
+
+    cookies = driver.get_cookies()
+    get_session_store().save(username, cookies)
+    apply_cookies_to_session(get_scraper_session(), cookies)
+    return True
+
+def _size_list_url(product_url):
+    """Convert a product page URL to its Snidan size list API URL"""
+    return product_url.replace('products', 'v1/sneakers') + "/size/list"
+
+def _meta_content(soup, prop):
+    """Return the content of a <meta property=...> tag, if present"""
+    tag = soup.find("meta", attrs={"property": prop})
+    return tag.get("content", "").strip() if tag else ""
+
+def fetch_product_info(url):
+    """Get product information over plain HTTP (no browser).
+
+    The name and image come from the product page HTML, the sizes from the
+    same size list API that get_current_prices uses. Returns None when any
+    of them cannot be found, so callers can fall back to get_product_info.
+    """
+    try:
+        logger.info(f"Fetching product info over HTTP for URL: {url}")
+        session = get_scraper_session()
+        
+        response = session.get(url)
+        if response.status_code != 200:
+            logger.warning(f"Failed to get product page. Status code: {response.status_code}")
+            return None
+        
+        soup = BeautifulSoup(response.content, "lxml")
+        
+        name_element = soup.select_one(".product-name-jp")
+        product_name = name_element.get_text(strip=True) if name_element else _meta_content(soup, "og:title")
+        
+        image_element = soup.select_one(".product-img img")
+        image_url = image_element.get("src") if image_element and image_element.get("src") else _meta_content(soup, "og:image")
+        
+        response = session.get(_size_list_url(url))
+        if response.status_code != 200:
+            logger.warning(f"Failed to get size list. Status code: {response.status_code}")
+            return None
+        
+        data = response.json()
+        if not data or 'data' not in data or 'minPriceOfSizeList' not in data['data']:
+            logger.warning("Invalid size list response format")
+            return None
+        
+        # Sizes without a listing are kept with price 0, like the browser path does
+        size_price_info = [
+            {'size': _size_label(item['size']), 'price': max(item['price'], 0)}
+            for item in data['data']['minPriceOfSizeList']
+        ]
+        
+        if not product_name or not size_price_info:
+            logger.warning("Product name or sizes missing from HTTP response")
+            return None
+        
+        logger.info(f"Successfully fetched product info over HTTP: {product_name}")
+        return {
+            'name': product_name,
+            'image_url': image_url,
+            'sizes': size_price_info
+        }
+    
+    except Exception as e:
+        logger.warning(f"Error fetching product info over HTTP: {str(e)}")
+        return None
+
 def get_product_info(driver, url, username=None, password=None):
     """Get product information from Snidan"""
     # record = SnidanSettings.query.filter_by(username=username).first()
@@ -165,7 +390,7 @@ def get_product_info(driver, url, username=None, password=None):
             )
             if login_btn:
                 if username and password:
-                    if not login_to_snidan(driver, username, password):
+                    if not ensure_logged_in(driver, username, password):
                         logger.error("Failed to log in to Snidan")
                         return None
                 else:
@@ -254,52 +479,106 @@ def get_product_info(driver, url, username=None, password=None):
         return None
     
 
-def get_current_prices(driver, product):
-    """Get current prices for a product"""
+def _record_fetch(outcome):
+    """Count a price fetch outcome for the skip ratio metric"""
+    with _fetch_stats_lock:
+        _fetch_stats['requests'] += 1
+        if outcome:
+            _fetch_stats[outcome] += 1
+
+def get_fetch_stats():
+    """Return price fetch counters and the share of fetches that skipped parsing"""
+    with _fetch_stats_lock:
+        stats = dict(_fetch_stats)
+    skipped = stats['not_modified'] + stats['body_unchanged'] + stats['fingerprint_unchanged']
+    stats['skip_ratio'] = round(skipped / stats['requests'], 4) if stats['requests'] else 0.0
+    return stats
+
+def invalidate_price_cache(product_url=None):
+    """Forget cached size list responses so the next fetch is processed in full"""
+    with _response_cache_lock:
+        if product_url is None:
+            _response_cache.clear()
+        else:
+            _response_cache.pop(product_url, None)
+
+def _size_list_fingerprint(size_list):
+    """Return a stable hash of a minPriceOfSizeList payload"""
+    return hashlib.sha1(json.dumps(size_list, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def get_current_prices(driver, product, conditional=False):
+    """Get current prices for a product.
+
+    With conditional=True the request carries the validators of the previous
+    response, and PRICES_UNCHANGED is returned without parsing when the size
+    list has not changed since then.
+    """
     try:
         logger.info(f"Getting current prices for product: {product.name}")
         # Convert URL to Snidan API format
-        url = product.url.replace('products', 'v1/sneakers') + "/size/list"
+        url = _size_list_url(product.url)
         
-        # Make request to Snidan API with browser-like headers
-        headers = {
-            'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-            'accept-language': 'en-US,en;q=0.9',
-            'cache-control': 'max-age=0',
-            'sec-ch-ua': '"Chromium";v="134", "Not:A-Brand";v="24", "Google Chrome";v="134"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-            'sec-fetch-dest': 'document',
-            'sec-fetch-mode': 'navigate',
-            'sec-fetch-site': 'none',
-            'sec-fetch-user': '?1',
-            'upgrade-insecure-requests': '1',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36'
-        }
+        with _response_cache_lock:
+            cached = _response_cache.get(product.url) if conditional else None
+        
+        headers = {}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
         
-        response = requests.get(url, headers=headers)
+        response = get_scraper_session().get(url, headers=headers)
+        
+        if response.status_code == 304 and cached:
+            _record_fetch('not_modified')
+            logger.info("Size list not modified")
+            return PRICES_UNCHANGED
         
         if response.status_code != 200:
+            _record_fetch(None)
             logger.error(f"Failed to get size list. Status code: {response.status_code}")
             return None
+        
+        # Identical bytes mean identical prices, so skip JSON parsing altogether
+        body_hash = hashlib.sha1(response.content).hexdigest()
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+        if cached and cached['body_hash'] == body_hash:
+            with _response_cache_lock:
+                cached.update(validators)
+            _record_fetch('body_unchanged')
+            logger.info("Size list unchanged")
+            return PRICES_UNCHANGED
 
         data = response.json()
         if not data or 'data' not in data or 'minPriceOfSizeList' not in data['data']:
+            _record_fetch(None)
             logger.error("Invalid response format")
             return None
+        
+        size_list = data['data']['minPriceOfSizeList']
+        fingerprint = _size_list_fingerprint(size_list)
+        if cached and cached['fingerprint'] == fingerprint:
+            with _response_cache_lock:
+                cached.update(validators, body_hash=body_hash)
+            _record_fetch('fingerprint_unchanged')
+            logger.info("Size list prices unchanged")
+            return PRICES_UNCHANGED
 
         # Process the minPriceOfSizeList into a dictionary
         size_prices = {}
-        for item in data['data']['minPriceOfSizeList']:
+        for item in size_list:
             if item['price'] > 0:  # Only include sizes with prices
-                # Calculate size using the formula
-                calculated_size = 20 + (item['size'] - 12) * 0.5
-                size_str = f"{calculated_size:.1f}"
-                if size_str.endswith('.0'):
-                    size_str = size_str[:-2]
-                size_prices[f"{size_str}cm"] = item['price']
+                size_prices[_size_label(item['size'])] = item['price']
 
+        _record_fetch(None)
         if size_prices:
+            if conditional:
+                with _response_cache_lock:
+                    _response_cache[product.url] = dict(validators, body_hash=body_hash, fingerprint=fingerprint)
             logger.info(f"Successfully retrieved current prices for {len(size_prices)} sizes")
             return size_prices
         
@@ -308,4 +587,4 @@ def get_current_prices(driver, product):
 
     except Exception as e:
         logger.error(f"Error getting current prices: {str(e)}")
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import logging
+import threading
+from cryptography.fernet import Fernet, InvalidToken
+
+# Configure logging
+logger = logging.getLogger("snidan_session_store")
+
+# Session store settings (can be overridden in .env)
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SESSION_FILE = os.getenv("SESSION_STORE_FILE", os.path.join(data_dir, 'snidan_session.bin'))
+KEY_FILE = os.getenv("SESSION_STORE_KEY_FILE", os.path.join(data_dir, 'session.key'))
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "12"))
+
+
+def _load_key():
+    """Return the encryption key from SESSION_STORE_KEY or the key file, creating it if needed"""
+    key = os.getenv("SESSION_STORE_KEY")
+    if key:
+        return key.encode("utf-8")
+
+    if os.path.exists(KEY_FILE):
+        with open(KEY_FILE, "rb") as f:
+            return f.read().strip()
+
+    os.makedirs(os.path.dirname(KEY_FILE), exist_ok=True)
+    key = Fernet.generate_key()
+    # Create the key file readable by the owner only
+    fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    logger.info("Generated new session store key")
+    return key
+
+
+class SessionStore:
+    """Encrypted on-disk store for the logged-in Snidan cookie jar"""
+
+    def __init__(self, path=None, ttl_hours=None):
+        self.path = path or SESSION_FILE
+        self.ttl = (ttl_hours or SESSION_TTL_HOURS) * 3600
+        self._fernet = None
+        self._lock = threading.Lock()
+
+    def _cipher(self):
+        if self._fernet is None:
+            self._fernet = Fernet(_load_key())
+        return self._fernet
+
+    def save(self, username, cookies):
+        """Encrypt and save the cookies of a logged-in session"""
+        now = time.time()
+        payload = json.dumps({
+            'username': username,
+            'saved_at': now,
+            'expires_at': now + self.ttl,
+            'cookies': cookies
+        }).encode("utf-8")
+
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._cipher().encrypt(payload))
+            os.replace(tmp_path, self.path)
+        logger.info(f"Saved session cookies for {username}")
+
+    def load(self, username):
+        """Return the saved cookies for username, or None when missing, expired or unreadable"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return None
+            try:
+                with open(self.path, "rb") as f:
+                    data = json.loads(self._cipher().decrypt(f.read()))
+            except (InvalidToken, ValueError, OSError) as e:
+                logger.warning(f"Ignoring unreadable session store: {str(e)}")
+                return None
+
+        if data.get('username') != username:
+            return None
+        if data.get('expires_at', 0) <= time.time():
+            logger.info("Saved session has expired")
+            return None
+        return data.get('cookies') or None
+
+    def clear(self):
+        """Delete the saved session"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Return the process-wide session store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
@@ -16,8 +16,8 @@ logging.basicConfig(
 logger = logging.getLogger("setup")
 
 # Create data directory if it doesn't exist
-data_dir = Path("backend/data")
-data_dir.mkdir(exist_ok=True)
+data_dir = Path(__file__).resolve().parent / "data"
+data_dir.mkdir(parents=True, exist_ok=True)
 
 # Database file path
 db_path = data_dir / "snidan_monitor.db"
@@ -60,7 +60,9 @@ CREATE TABLE IF NOT EXISTS products (
     image_url TEXT,
     added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     last_checked TIMESTAMP,
-    is_active INTEGER DEFAULT 1
+    is_active INTEGER DEFAULT 1,
+    min_interval INTEGER,
+    max_interval INTEGER
 );
 
 -- Sizes table
@@ -74,6 +76,7 @@ CREATE TABLE IF NOT EXISTS sizes (
     highest_price INTEGER,
     notify_below INTEGER,
     notify_above INTEGER,
+    notify_drop_percent REAL,
     notify_on_any_change INTEGER DEFAULT 0,
     last_updated TIMESTAMP,
     FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
@@ -102,8 +105,110 @@ CREATE TABLE IF NOT EXISTS notification_history (
     FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
     FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE CASCADE
 );
+
+-- Outbound notification queue, drained by the notification dispatcher
+CREATE TABLE IF NOT EXISTS notification_queue (
+    id INTEGER PRIMARY KEY,
+    product_id INTEGER NOT NULL,
+    size_id INTEGER NOT NULL,
+    old_price INTEGER,
+    new_price INTEGER,
+    notification_type TEXT,
+    service TEXT NOT NULL,
+    group_key TEXT,
+    details TEXT,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+    FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE CASCADE
+);
+
+-- Last alert per size, for cooldown and hysteresis
+CREATE TABLE IF NOT EXISTS alert_state (
+    size_id INTEGER PRIMARY KEY,
+    last_alert_type TEXT,
+    last_alerted_price INTEGER,
+    last_alerted_at TIMESTAMP,
+    below_armed INTEGER NOT NULL DEFAULT 1,
+    above_armed INTEGER NOT NULL DEFAULT 1,
+    FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE CASCADE
+);
+
+-- Hourly and daily OHLC of each size's price, maintained as price history is written
+CREATE TABLE IF NOT EXISTS price_rollups (
+    size_id INTEGER NOT NULL,
+    period INTEGER NOT NULL,
+    bucket_start INTEGER NOT NULL,
+    open_price INTEGER,
+    high_price INTEGER,
+    low_price INTEGER,
+    close_price INTEGER,
+    change_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (size_id, period, bucket_start),
+    FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE CASCADE
+);
+
+-- Run-length encoded price history: one row per span of polls that saw the same price
+CREATE TABLE IF NOT EXISTS price_intervals (
+    id INTEGER PRIMARY KEY,
+    size_id INTEGER NOT NULL,
+    price INTEGER NOT NULL,
+    valid_from TIMESTAMP NOT NULL,
+    valid_to TIMESTAMP NOT NULL,
+    FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE CASCADE
+);
+
+-- Notifications that could not be delivered after all retries
+CREATE TABLE IF NOT EXISTS notification_dead_letters (
+    id INTEGER PRIMARY KEY,
+    product_id INTEGER NOT NULL,
+    size_id INTEGER NOT NULL,
+    old_price INTEGER,
+    new_price INTEGER,
+    notification_type TEXT,
+    service TEXT NOT NULL,
+    group_key TEXT,
+    details TEXT,
+    message TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    status_code INTEGER,
+    created_at TIMESTAMP,
+    failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    replayed_at TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+    FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE CASCADE
+);
+"""
+
+# Indexes, created after the column migrations so they can cover new columns
+create_indexes_sql = """
+CREATE INDEX IF NOT EXISTS ix_price_history_size_timestamp ON price_history (size_id, timestamp);
+CREATE INDEX IF NOT EXISTS ix_price_intervals_size_valid_from ON price_intervals (size_id, valid_from);
+CREATE INDEX IF NOT EXISTS ix_notification_history_timestamp ON notification_history (timestamp);
+CREATE INDEX IF NOT EXISTS ix_notification_history_product_timestamp ON notification_history (product_id, timestamp);
+CREATE INDEX IF NOT EXISTS ix_notification_history_size_timestamp ON notification_history (size_id, timestamp);
+CREATE INDEX IF NOT EXISTS ix_notification_history_sent_to_timestamp ON notification_history (sent_to, timestamp);
+CREATE INDEX IF NOT EXISTS ix_notification_history_type_timestamp ON notification_history (notification_type, timestamp);
+CREATE INDEX IF NOT EXISTS ix_notification_queue_status_next_attempt ON notification_queue (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS ix_notification_dead_letters_failed_at ON notification_dead_letters (failed_at);
 """
 
+# Columns added after the first release: (table, column, definition).
+# Existing databases get them through migrate_database().
+column_migrations = [
+    ("products", "min_interval", "INTEGER"),
+    ("products", "max_interval", "INTEGER"),
+    ("notification_queue", "group_key", "TEXT"),
+    ("notification_queue", "details", "TEXT"),
+    ("sizes", "notify_drop_percent", "REAL"),
+]
+
 # Initialize default settings
 default_settings = [
     ("app_name", "スニダン価格監視"),
@@ -140,10 +245,99 @@ def create_env_file():
             f.write("SNIDAN_PASSWORD=\n\n")
             f.write("# Monitoring settings\n")
             f.write("MONITORING_INTERVAL=10\n")
+            f.write("MONITOR_WORKERS=16\n")
+            f.write("MONITOR_PER_HOST_LIMIT=8\n")
+            f.write("MONITOR_SWEEP_DEADLINE=300\n")
+            f.write("MONITOR_MAX_INTERVAL=900\n")
+            f.write("MONITOR_VOLATILITY_WINDOW_HOURS=24\n")
+            f.write("MONITOR_FLUSH_EVERY=50\n")
+            f.write("MONITOR_FLUSH_INTERVAL=5\n")
+            f.write("PRODUCT_CACHE_SIZE=10000\n")
+            f.write("PRICE_STREAM_BUFFER=5000\n")
+            f.write("PRICE_STREAM_MAX_CLIENTS=50\n")
+            f.write("HTTP_COMPRESS_MIN_SIZE=1024\n")
+            f.write("HTTP_RESPONSE_CACHE_SIZE=256\n\n")
+            f.write("# Price history retention in days (0 keeps forever)\n")
+            f.write("HISTORY_RAW_RETENTION_DAYS=30\n")
+            f.write("HISTORY_HOURLY_RETENTION_DAYS=365\n")
+            f.write("HISTORY_COMPACTION_INTERVAL=3600\n")
+            f.write("HISTORY_INTERVAL_MAX_GAP=3600\n\n")
+            f.write("# Browser settings\n")
+            f.write("DRIVER_POOL_SIZE=2\n")
+            f.write("DRIVER_MAX_USES=50\n")
+            f.write("DRIVER_MAX_MEMORY_MB=1024\n\n")
+            f.write("# Notification delivery settings\n")
+            f.write("NOTIFY_WORKERS=4\n")
+            f.write("NOTIFY_MAX_ATTEMPTS=5\n")
+            f.write("NOTIFY_TIMEOUT=10\n")
+            f.write("NOTIFY_COALESCE_WINDOW=0\n")
+            f.write("NOTIFY_COALESCE_BY=product\n")
+            f.write("# Alert noise suppression\n")
+            f.write("ALERT_COOLDOWN_SECONDS=300\n")
+            f.write("ALERT_HYSTERESIS_PERCENT=2\n")
+            f.write("ALERT_MIN_DELTA_YEN=300\n")
+            f.write("ALERT_MIN_DELTA_PERCENT=1\n")
+            f.write("# Rate limits as requests/seconds\n")
+            f.write("NOTIFY_RATE_LIMIT_LINE=2000/1\n")
+            f.write("NOTIFY_RATE_LIMIT_DISCORD=5/2\n")
+            f.write("NOTIFY_RATE_LIMIT_CHATWORK=10/10\n\n")
+            f.write("# HTTP settings\n")
+            f.write("HTTP_POOL_SIZE=16\n")
+            f.write("HTTP_CONNECT_TIMEOUT=5\n")
+            f.write("HTTP_READ_TIMEOUT=15\n")
         logger.info(".env file created successfully")
     else:
         logger.info(".env file already exists")
 
+def apply_migrations(cursor):
+    """Bring an existing schema up to date with the current table definitions"""
+    # New tables
+    cursor.executescript(create_tables_sql)
+    
+    # New columns on existing tables
+    for table, column, definition in column_migrations:
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing_columns = {row[1] for row in cursor.fetchall()}
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            logger.info(f"Added column {table}.{column}")
+    
+    # Indexes for the history and dashboard queries
+    cursor.executescript(create_indexes_sql)
+    
+    # Roll up the history recorded before the rollup tables existed
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM price_rollups) OR NOT EXISTS (SELECT 1 FROM price_history)")
+    if not cursor.fetchone()[0]:
+        import price_rollups
+        price_rollups.backfill(cursor)
+        logger.info("Built price rollups from the existing price history")
+    
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM price_intervals) OR NOT EXISTS (SELECT 1 FROM price_history)")
+    if not cursor.fetchone()[0]:
+        import price_intervals
+        price_intervals.backfill(cursor)
+        logger.info("Built price intervals from the existing price history")
+    
+    # Delivered messages used to be kept in the queue; notification_history already records them
+    cursor.execute("DELETE FROM notification_queue WHERE status = 'sent'")
+    if cursor.rowcount > 0:
+        logger.info(f"Removed {cursor.rowcount} delivered messages from the notification queue")
+
+def migrate_database():
+    """Apply pending schema migrations to the existing database"""
+    logger.info("Migrating database")
+    conn = sqlite3.connect(db_path)
+    try:
+        # WAL is persistent, so switching once here covers every later connection
+        conn.execute("PRAGMA journal_mode=WAL")
+        apply_migrations(conn.cursor())
+        conn.commit()
+        # Refresh query planner statistics for the new indexes
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    logger.info("Database migrated successfully")
+
 def initialize_database():
     """Initialize the SQLite database with required tables and default settings."""
     logger.info("Initializing database")
@@ -151,10 +345,13 @@ def initialize_database():
     
     # Connect to database
     conn = sqlite3.connect(db_path)
+    # Must be set before the first table exists; lets retention hand freed pages back without a full VACUUM
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
     
     # Create tables
-    cursor.executescript(create_tables_sql)
+    apply_migrations(cursor)
     
     # Check if settings table is empty
     cursor.execute("SELECT COUNT(*) FROM settings")
@@ -0,0 +1,89 @@
+import pytest
+from flask import Flask
+from sqlalchemy import event
+from database import db, init_app
+from models import Product, Size
+from product_cache import get_product_cache
+import http_cache
+import product_queries
+import routes
+
+
+def make_app(product_count):
+    """Return an app on an in-memory database holding `product_count` products of 3 sizes each"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.secret_key = "test"
+    init_app(app)
+    routes.register_routes(app, db)
+    with app.app_context():
+        db.create_all()
+        for product_id in range(1, product_count + 1):
+            db.session.add(Product(id=product_id, url=f"https://snkrdunk.com/products/{product_id}", name=f"product {product_id}"))
+            for index, label in enumerate(("26.0cm", "27.0cm", "28.0cm")):
+                db.session.add(Size(product_id=product_id, size=label, current_price=10000 + index))
+        db.session.commit()
+    return app
+
+
+def count_statements(app, action):
+    """Run `action` in an app context and return the number of SQL statements it executed"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            action()
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+            db.session.remove()
+            db.engine.dispose()
+    return len(statements)
+
+
+def read_product_list(app):
+    # Start from cold caches, so the listing is read from the database
+    get_product_cache().invalidate()
+    http_cache.bump(http_cache.PRODUCTS)
+    response = app.test_client().get("/v1/products")
+    assert response.status_code == 200
+    return response.get_json()
+
+
+@pytest.mark.parametrize("query", ["list", "single"])
+def test_product_queries_do_not_grow_with_catalog(query):
+    counts = []
+    for product_count in (1, 10, 200):
+        app = make_app(product_count)
+        if query == "list":
+            products = []
+            counts.append(count_statements(app, lambda: products.extend(read_product_list(app))))
+            assert len(products) == product_count
+            assert all(len(product["sizes"]) == 3 for product in products)
+        else:
+            loaded = []
+            counts.append(count_statements(app, lambda: loaded.extend(product_queries.load_products(db, product_id=product_count)[0])))
+            assert [product["id"] for product in loaded] == [product_count]
+            assert len(loaded[0]["sizes"]) == 3
+    assert 0 < counts[0] == counts[1] == counts[2], counts
+
+
+def test_paged_listing_is_one_query():
+    app = make_app(25)
+    pages = []
+
+    def read_pages():
+        after_id = None
+        while True:
+            products, after_id = product_queries.load_products(db, after_id=after_id, limit=10)
+            pages.append([product["id"] for product in products])
+            if after_id is None:
+                break
+
+    assert count_statements(app, read_pages) == 3
+    assert pages == [list(range(1, 11)), list(range(11, 21)), list(range(21, 26))]
@@ -61,6 +61,15 @@ async function handleResponse(response: Response) {
   return await response.json();
 }
 
+// Price change pushed by /stream/prices
+export interface PriceChangeEvent {
+  product_id: number;
+  size: string;
+  old: number | null;
+  new: number;
+  ts: string;
+}
+
 // Products API
 export const productsApi = {
   // Get all products
@@ -89,9 +98,21 @@ export const productsApi = {
       method: 'DELETE',
     }),
   
-  // Get price history for a product
-  getPriceHistory: (id: number) => 
-    fetchFromAPI(`/products/${id}/history`),
+  // Get downsampled price history for a product's chart
+  // (from / to / resolution / points / mode=ohlc|lttb)
+  getPriceHistory: (id: number, params: Record<string, string> = {}) =>
+    fetchFromAPI(`/products/${id}/history?${new URLSearchParams(params)}`),
+  
+  // Subscribe to live price changes ({product_id, size, old, new, ts});
+  // onReset is called when changes were missed and the products must be reloaded.
+  // Returns a function that closes the stream.
+  subscribePriceChanges: (onChange: (change: PriceChangeEvent) => void, onReset: () => void) => {
+    // EventSource reconnects by itself and resumes after the last event id it received
+    const source = new EventSource(`${base_url}/stream/prices`);
+    source.addEventListener('price', (event) => onChange(JSON.parse((event as MessageEvent).data)));
+    source.addEventListener('reset', onReset);
+    return () => source.close();
+  },
 };
 
 // Notification API
@@ -106,8 +127,10 @@ export const notificationsApi = {
       body: JSON.stringify(settings),
     }),
   
-  // Get notification history
-  getHistory: () => fetchFromAPI('/notifications/history'),
+  // Get a page of notification history; pass next_cursor from the previous page as `cursor`
+  // to continue, and product_id / size_id / channel / type to filter
+  getHistory: (params: Record<string, string> = {}) =>
+    fetchFromAPI(`/notifications/history?${new URLSearchParams(params)}`),
 };
 
 // Snidan account API
@@ -76,6 +76,21 @@ export default function Home() {
     }
 
     fetchProducts();
+    
+    // Apply live price changes instead of re-fetching the whole list
+    const unsubscribe = productsApi.subscribePriceChanges(
+      (change) => setProducts(current => current.map(product =>
+        product.id !== change.product_id ? product : {
+          ...product,
+          sizes: product.sizes.map(size =>
+            size.size !== change.size ? size : { ...size, previous_price: change.old ?? change.new, current_price: change.new }
+          )
+        }
+      )),
+      // Changes were missed, reload everything
+      () => productsApi.getProducts().then(setProducts).catch(err => console.error('商品の取得に失敗しました:', err))
+    );
+    return unsubscribe;
   }, []);
 
   const handleDeleteProduct = async (id: number) => {
@@ -191,6 +191,21 @@ export function ProductEdit({ initialProduct }: ProductEditProps) {
                   helperText="この価格以上になったら通知します"
                 />
               </Grid>
+              
+              <Grid item xs={12} sm={6}>
+                <TextField
+                  fullWidth
+                  label="値下がり率"
+                  name={`notify_drop_percent_${size.id}`}
+                  type="number"
+                  value={size.notify_drop_percent || ''}
+                  onChange={(e) => handleSizeChange(size.id, 'notify_drop_percent', e.target.value === '' ? null : Number(e.target.value))}
+                  InputProps={{
+                    endAdornment: <InputAdornment position="end">%</InputAdornment>,
+                  }}
+                  helperText="一度にこの割合以上値下がりしたら通知します"
+                />
+              </Grid>
             </Grid>
           </Paper>
         ))}
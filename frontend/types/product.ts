@@ -7,6 +7,7 @@ export interface Size {
   highest_price: number;
   notify_below: number | null;
   notify_above: number | null;
+  notify_drop_percent: number | null;
   notify_on_any_change: boolean;
 }
 